@@ -50,8 +50,8 @@ if __name__ == '__main__':
     		# This function loads the firmware to all the ADM1266 addresses defined above
     		ADM1266_Lib.program_firmware()
     		# This function loads the repective configuration files to all the ADM1266 address defined above.
-    		ADM1266_Lib.program_configration()
-    		ADM1266_Lib.crc_summary()
+    		reports = ADM1266_Lib.program_configration()
+    		ADM1266_Lib.crc_summary(reports)
     	elif update_type == 2:
     		ADM1266_Lib.program_firmware()
     		ADM1266_Lib.crc_summary()
@@ -59,10 +59,10 @@ if __name__ == '__main__':
     		reset_type = input("Enter '1' to do seamless reset or any other input for a sequence reset after update: ")  
     		reset_type = int(reset_type, 10)
     		if reset_type == 1:
-    			ADM1266_Lib.program_configration(False)
+    			reports = ADM1266_Lib.program_configration(False)
     		else:
-    			ADM1266_Lib.program_configration()    		
-    		ADM1266_Lib.crc_summary()
+    			reports = ADM1266_Lib.program_configration()    		
+    		ADM1266_Lib.crc_summary(reports)
     	else:
     		print("Not a valid input selected.")       
 
@@ -0,0 +1,176 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# asyncio version of the core ADM1266_Lib operations, so one event loop can serve many devices and buses.
+# Every bus is an Async_Bus, which allows one transaction at a time on the bus. The waits the device needs, e.g. after a
+# flash write, are done with asyncio.sleep outside of the bus lock, so other devices on the same bus can use the bus meanwhile.
+# The blocking transport calls are run in the default executor of the event loop.
+# Example:
+#   bus = ADM1266_Async.Async_Bus(PMBus_I2C.Get_Transport())
+#   await asyncio.gather(*[ADM1266_Async.program_hex(bus, address, file) for (address, file) in configs])
+# System_Parse, Get_Current_Data and Get_Raw_Data fill the same global lists as ADM1266_Lib, the other functions only return data.
+
+import PMBus_I2C
+import ADM1266_Lib
+import asyncio
+import sys
+import time
+
+
+class Async_Bus:
+    def __init__(self, transport=None):
+        self.transport = PMBus_I2C.Get_Transport() if transport is None else transport
+        # see ADM1266_Lib.block_payload
+        self.max_write_length = getattr(self.transport, 'max_write_length', None)
+        self.lock = None
+
+    # the lock is created on first use, so it belongs to the running event loop
+    def bus_lock(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    async def run(self, function, *args):
+        async with self.bus_lock():
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def write_read(self, device_address, write_data, read_length):
+        return await self.run(self.transport.write_read, device_address, write_data, read_length)
+
+    async def batch_write_read(self, device_address, requests):
+        return await self.run(self.transport.batch_write_read, device_address, requests)
+
+    async def write(self, device_address, write_data):
+        return await self.run(self.transport.write, device_address, write_data)
+
+
+async def delay(ms):
+    if ADM1266_Lib.Delay_Hook is None:
+        await asyncio.sleep((ms + 1) / 1000.0)
+    else:
+        start = time.time()
+        await asyncio.sleep((ms + 1) / 1000.0)
+        ADM1266_Lib.Delay_Hook(ms, time.time() - start, ADM1266_Lib.delay_caller(sys._getframe(1)))
+
+
+# Same as ADM1266_Lib.wait_ready, the bus is free for the other devices between the polls.
+async def wait_ready(bus, device_address, timeout_ms):
+    start = time.time()
+    ready = False
+    while True:
+        status = await bus.write_read(device_address, [0x80], 1)
+        if len(status) == 1 and (status[0] & 0x08) == 0:
+            ready = True
+            break
+        elapsed_ms = (time.time() - start) * 1000.0
+        if elapsed_ms >= timeout_ms:
+            break
+        await asyncio.sleep(min(ADM1266_Lib.POLL_INTERVAL_MS, timeout_ms - elapsed_ms) / 1000.0)
+    if ADM1266_Lib.Delay_Hook is not None:
+        ADM1266_Lib.Delay_Hook(timeout_ms, time.time() - start, ADM1266_Lib.delay_caller(sys._getframe(1)))
+    return ready
+
+
+async def device_present(bus, device_addresses):
+    ic_ids = await asyncio.gather(*[bus.write_read(device_address, [0xAD], 4) for device_address in device_addresses])
+    for (device_address, ic_id) in zip(device_addresses, ic_ids):
+        if not (len(ic_id) == 4 and (ic_id[1] == 66 or ic_id[1] == 65) and ic_id[2] == 18 and ic_id[3] == 102):
+            raise Exception('Device with address ' + hex(device_address) + " is not present.")
+    return True
+
+
+async def refresh_status(bus, device_addresses):
+    statuses = await asyncio.gather(*[bus.write_read(device_address, [0x80], 1) for device_address in device_addresses])
+    return any((status[0] & 0x08) >> 3 == 1 for status in statuses)
+
+
+async def get_firmware_rev(bus, device_address):
+    data = await bus.write_read(device_address, [0xAE], 9)
+    return data[1:4]
+
+
+async def unlock(bus, device_address,
+                 pwd=[0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff]):
+    assert len(pwd) == 16
+    for i in range(2):
+        await bus.write(device_address, [0xFD, 0x11] + pwd + [0x02])
+        await delay(1)
+
+
+async def islocked(bus, device_address):
+    status = await bus.write_read(device_address, [0x80], 1)
+    return (status[0] & 0x04) > 0
+
+
+# Returns the blocks of system data read back from the device, see ADM1266_Lib.System_Read.
+async def System_Read(bus, device_address):
+    blocks = [await bus.write_read(device_address, [0xD7, 0x03, 0x80, 0x00, 0x00], 129)]
+    Data_length = blocks[0][1] + (blocks[0][2] * 256)
+    for (n, l, k) in ADM1266_Lib.System_Blocks(Data_length):
+        blocks.append(await bus.write_read(device_address, [0xD7, 0x03, n, l, int(k)], n + 1))
+    return blocks
+
+
+# Read back the system data of all the devices at the same time and parse it into the ADM1266_Lib lists.
+async def System_Parse(bus, device_addresses):
+    device_blocks = await asyncio.gather(*[System_Read(bus, device_address) for device_address in device_addresses])
+    for blocks in device_blocks:
+        Data_length = ADM1266_Lib.System_Summary(blocks[0])
+        for ((n, l, k), read_data) in zip(ADM1266_Lib.System_Blocks(Data_length), blocks[1:]):
+            ADM1266_Lib.System_Data_Extend(read_data, n, l, k)
+    ADM1266_Lib.System_Data_Parse()
+
+
+# Returns the raw 0xE8, 0xE7, 0xE9 and 0xEA telemetry of the device.
+async def Read_Current_Data(bus, device_address):
+    return await bus.batch_write_read(device_address, [([0xE8], 52), ([0xE7], 18), ([0xE9], 3), ([0xEA], 3)])
+
+
+async def Get_Current_Data(bus, device_addresses):
+    telemetry = await asyncio.gather(*[Read_Current_Data(bus, device_address) for device_address in device_addresses])
+    for i in range(len(device_addresses)):
+        ADM1266_Lib.Current_Data_Parse(i, *telemetry[i])
+
+
+# Returns (record index, number of records) of the blackbox of the device.
+async def Number_Of_Records(bus, device_address):
+    read_data = await bus.write_read(device_address, [0xE6], 5)
+    return (read_data[3], read_data[4])
+
+
+async def Indexed_Blackbox_Data(bus, device_address, index):
+    return await bus.write_read(device_address, [0xDE, 0x01, index], 65)
+
+
+# Read back the blackbox record of all the devices into ADM1266_Lib.BB_Data, see ADM1266_Lib.Get_Raw_Data.
+async def Get_Raw_Data(bus, device_addresses, record_number):
+    (ADM1266_Lib.Record_Index, ADM1266_Lib.Num_Records) = await Number_Of_Records(bus, device_addresses[0])
+    j = ADM1266_Lib.Record_Index + int(record_number) - ADM1266_Lib.Num_Records
+    if j < 0:
+        j += 32
+    records = await asyncio.gather(*[Indexed_Blackbox_Data(bus, device_address, j) for device_address in device_addresses])
+    for i in range(len(device_addresses)):
+        ADM1266_Lib.BB_Data[i] = records[i]
+
+
+# Same as ADM1266_Lib.program_hex, while the device waits after a record the bus is free for the other devices.
+@ADM1266_Lib.operation
+async def program_hex(bus, device_address, file, unlock_and_stop=True, main=True, poll=None):
+    poll = ADM1266_Lib.Poll_Ready if poll is None else poll
+    plan = ADM1266_Lib.load_plan(file, transport=bus)
+    if unlock_and_stop:
+        await unlock(bus, device_address)
+        assert (await islocked(bus, device_address)) == False, 'device @0x{0:02X} should be unlocked!'.format(device_address)
+    await bus.write(device_address, [0xFA, 1, 0 if main else 1])
+    for (cmd, write_data, delay_ms) in plan.records:
+        if cmd != 0xD8:
+            await bus.write(device_address, write_data)
+        if poll and cmd != 0xD8:
+            await wait_ready(bus, device_address, delay_ms)
+        else:
+            await delay(delay_ms)
@@ -0,0 +1,233 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Estimate how long program_firmware and program_configration take, without any transaction on the bus.
+# The steps and the records of the hex files are walked with the same delays as ADM1266_Lib, the time on the bus is modelled
+# from the bitrate. The configuration of several devices is scheduled like program_hex_interleaved, so the total of the system
+# is the critical path of the shared bus and the device waits.
+# The time is broken down into bus time, flash delays (the waits after the records), the memory refresh, the reset waits
+# (system reset and jump to IAP) and the other fixed waits. With poll (ADM1266_Lib.Poll_Ready) the device is read once after
+# every record and the flash delays are the longest wait, the programming is usually faster.
+# With differential the configuration blocks are read back from the devices, the same reads as program_hex_diff, and only the
+# records which program_hex_diff would write are counted. These reads are the only transactions, nothing is written.
+# Example:
+#   ADM1266_Lib.program_configration(dry_run=True)
+#   or
+#   (devices, system) = ADM1266_Estimate.Estimate_Configuration([0x40, 0x42], ["device@40.hex", "device@42.hex"], 400)
+#   ADM1266_Estimate.Print_Estimate(devices, system)
+
+import ADM1266_Lib
+import ADM1266_Plan
+import PMBus_I2C
+
+# Bitrate of the Aardvark after it is opened
+DEFAULT_BITRATE_KHZ = 100
+
+# Time of a transaction through the dongle besides the clocks on the bus, e.g. the USB round trip
+TRANSACTION_OVERHEAD_MS = 1.0
+
+
+class time_estimate:
+    def __init__(self, address=None):
+        # device address, None for the whole system
+        self.address = address
+        self.bus_ms = 0.0
+        self.flash_ms = 0.0
+        self.refresh_ms = 0.0
+        self.reset_ms = 0.0
+        self.wait_ms = 0.0
+        # time until the programming is done, for the system the critical path
+        self.total_ms = 0.0
+        # the devices are polled, the flash delays are the longest wait
+        self.upper_bound = False
+
+    def add(self, other):
+        self.bus_ms += other.bus_ms
+        self.flash_ms += other.flash_ms
+        self.refresh_ms += other.refresh_ms
+        self.reset_ms += other.reset_ms
+        self.wait_ms += other.wait_ms
+        self.total_ms += other.total_ms
+
+
+# Time in ms of a transaction: start, address byte and the bytes written, then for a read a repeated start, address byte and
+# the bytes read, and the stop. Every byte is 9 clocks with its acknowledge.
+def Bus_Time_Ms(write_length, read_length=0, bitrate_khz=DEFAULT_BITRATE_KHZ):
+    clocks = 9 * (1 + write_length) + 2
+    if read_length > 0:
+        clocks += 9 * (1 + read_length) + 1
+    return TRANSACTION_OVERHEAD_MS + clocks / float(bitrate_khz)
+
+
+def Group_Time_Ms(device_addresses, write_length, bitrate_khz):
+    return sum(Bus_Time_Ms(write_length, 0, bitrate_khz) for device_address in device_addresses)
+
+
+# Returns the bitrate of the selected transport if it is known, otherwise DEFAULT_BITRATE_KHZ.
+def Transport_Bitrate():
+    bitrate_khz = getattr(PMBus_I2C.Get_Transport(), 'bitrate_khz', None)
+    return DEFAULT_BITRATE_KHZ if bitrate_khz is None else bitrate_khz
+
+
+# delay(ms) of ADM1266_Lib sleeps 1 ms more than asked for
+def Delay_Ms(ms):
+    return ms + 1
+
+
+def Unlock_Estimate(estimate, bitrate_khz):
+    # two password writes each followed by delay(1), then the read of STATUS_MFR_SPECIFIC to check the lock
+    estimate.bus_ms += 2 * Bus_Time_Ms(19, 0, bitrate_khz) + Bus_Time_Ms(1, 1, bitrate_khz)
+    estimate.wait_ms += 2 * Delay_Ms(1)
+
+
+def Finish(estimate):
+    estimate.total_ms = estimate.bus_ms + estimate.flash_ms + estimate.refresh_ms + estimate.reset_ms + estimate.wait_ms
+    return estimate
+
+
+# Time in ms of the reads of program_hex_diff, which compare the configuration blocks of the file with the device.
+def Diff_Time_Ms(records, bitrate_khz):
+    read_ms = 0.0
+    for cmd in ADM1266_Lib.Diff_Block_Commands:
+        section = [record for record in records if record[0] == cmd]
+        for (offset, data) in ADM1266_Lib.block_writes(section):
+            read_ms += Bus_Time_Ms(5, len(data) + 1, bitrate_khz)
+    return read_ms
+
+
+# Estimate of program_firmware, the devices are programmed one after the other.
+# Returns (dict of device address -> time_estimate, time_estimate of the system).
+def Estimate_Firmware(device_addresses=None, file=None, bitrate_khz=None, poll=None):
+    device_addresses = ADM1266_Lib.ADM1266_Address if device_addresses is None else device_addresses
+    file = ADM1266_Lib.firmware_file_name if file is None else file
+    bitrate_khz = Transport_Bitrate() if bitrate_khz is None else bitrate_khz
+    poll = ADM1266_Lib.Poll_Ready if poll is None else poll
+    records = ADM1266_Lib.load_plan(file, True).records
+
+    devices = {}
+    system = time_estimate()
+    system.upper_bound = poll
+    # pause_sequence_all
+    system.bus_ms += Group_Time_Ms(device_addresses, 3, bitrate_khz)
+    system.wait_ms += Delay_Ms(10)
+    for device_address in device_addresses:
+        estimate = time_estimate(device_address)
+        estimate.upper_bound = poll
+        # bootloader revision, unlock and jump to IAP
+        estimate.bus_ms += Bus_Time_Ms(1, 9, bitrate_khz)
+        Unlock_Estimate(estimate, bitrate_khz)
+        estimate.bus_ms += Bus_Time_Ms(4, 0, bitrate_khz)
+        estimate.reset_ms += Delay_Ms(1000)
+        for (cmd, write_data, delay_ms) in records:
+            if cmd != 0xD8:
+                estimate.bus_ms += Bus_Time_Ms(len(write_data), 0, bitrate_khz)
+            if poll and cmd != 0xD8:
+                estimate.bus_ms += Bus_Time_Ms(1, 1, bitrate_khz)
+            estimate.flash_ms += Delay_Ms(delay_ms)
+        devices[device_address] = Finish(estimate)
+        system.add(estimate)
+    # system_reset_all
+    system.bus_ms += Group_Time_Ms(device_addresses, 3, bitrate_khz)
+    system.reset_ms += Delay_Ms(1000)
+    return (devices, Finish(system))
+
+
+# Estimate of program_configration. With verify every block record is also read back, see ADM1266_Lib.Verify_Blocks.
+# With differential only the blocks which differ from the devices are counted, see ADM1266_Lib.program_hex_diff.
+# Returns (dict of device address -> time_estimate, time_estimate of the system).
+def Estimate_Configuration(device_addresses=None, files=None, bitrate_khz=None, verify=None, differential=False, poll=None):
+    device_addresses = ADM1266_Lib.ADM1266_Address if device_addresses is None else device_addresses
+    files = ADM1266_Lib.config_file_name if files is None else files
+    bitrate_khz = Transport_Bitrate() if bitrate_khz is None else bitrate_khz
+    verify = ADM1266_Lib.Verify_Blocks if verify is None else verify
+    poll = ADM1266_Lib.Poll_Ready if poll is None else poll
+
+    devices = {}
+    system = time_estimate()
+    system.upper_bound = poll
+    # pause_sequence_all
+    system.bus_ms += Group_Time_Ms(device_addresses, 3, bitrate_khz)
+    system.wait_ms += Delay_Ms(10)
+    clock = system.bus_ms + system.wait_ms
+    device_records = {}
+    for x in range(len(device_addresses)):
+        device_address = device_addresses[x]
+        estimate = time_estimate(device_address)
+        estimate.upper_bound = poll
+        Unlock_Estimate(estimate, bitrate_khz)
+        # switch_memory
+        estimate.bus_ms += Bus_Time_Ms(3, 0, bitrate_khz)
+        device_records[device_address] = ADM1266_Lib.load_plan(files[x]).records
+        if differential:
+            estimate.bus_ms += Diff_Time_Ms(device_records[device_address], bitrate_khz)
+            device_records[device_address] = ADM1266_Lib.diff_records(device_address, files[x])[0]
+        devices[device_address] = estimate
+        clock += estimate.bus_ms + estimate.wait_ms
+
+    # Same scheduling as program_hex_interleaved: the device which is ready first gets the bus for its next record.
+    streams = {}
+    ready_at = {}
+    for x in range(len(device_addresses)):
+        streams[device_addresses[x]] = iter(device_records[device_addresses[x]])
+        ready_at[device_addresses[x]] = clock
+    records_start = clock
+    bus_ms = 0.0
+    while len(streams) > 0:
+        device_address = min(streams, key=lambda x: ready_at[x])
+        record = next(streams[device_address], None)
+        if record is None:
+            del streams[device_address]
+            continue
+        (cmd, write_data, delay_ms) = record
+        clock = max(clock, ready_at[device_address])
+        transaction_ms = 0.0
+        if cmd != 0xD8:
+            transaction_ms = Bus_Time_Ms(len(write_data), 0, bitrate_khz)
+        if verify and cmd in ADM1266_Lib.Diff_Block_Commands and ADM1266_Plan.Block_Offset(cmd, write_data) is not None:
+            transaction_ms += Bus_Time_Ms(5, len(write_data) - 3, bitrate_khz)
+        if poll and cmd != 0xD8:
+            transaction_ms += Bus_Time_Ms(1, 1, bitrate_khz)
+        clock += transaction_ms
+        bus_ms += transaction_ms
+        devices[device_address].bus_ms += transaction_ms
+        devices[device_address].flash_ms += Delay_Ms(delay_ms)
+        ready_at[device_address] = clock + Delay_Ms(delay_ms)
+    records_ms = max([clock] + list(ready_at.values())) - records_start
+
+    # the transactions of all the devices are on the bus one after the other, the rest of the critical path of the records
+    # is waiting for the flash
+    for device_address in device_addresses:
+        system.bus_ms += devices[device_address].bus_ms
+        system.wait_ms += devices[device_address].wait_ms
+        Finish(devices[device_address])
+    system.flash_ms += records_ms - bus_ms
+    # start_sequence_all, unlock_all, refresh_flash_all and the wait for the memory refresh
+    system.bus_ms += Group_Time_Ms(device_addresses, 3, bitrate_khz) + 2 * Group_Time_Ms(device_addresses, 19, bitrate_khz)
+    system.bus_ms += Group_Time_Ms(device_addresses, 3, bitrate_khz)
+    system.wait_ms += Delay_Ms(500) + 2 * Delay_Ms(1)
+    system.refresh_ms += Delay_Ms(10000)
+    return (devices, Finish(system))
+
+
+def Print_Estimate(devices, system, title='Estimated Programming Time'):
+    print('\n' + title)
+    print('---------------------------------------')
+    print('{0:<8} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}'.format('Device', 'Bus s', 'Flash s', 'Refresh s', 'Reset s',
+                                                                   'Wait s', 'Total s'))
+    for device_address in sorted(devices):
+        Print_Row('{0:#04x}'.format(device_address), devices[device_address])
+    Print_Row('System', system)
+    if system.upper_bound:
+        print('The devices are polled, the flash times are the longest waits.')
+    return (devices, system)
+
+
+def Print_Row(name, estimate):
+    print('{0:<8} {1:>9.2f} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>9.2f}'.format(
+        name, estimate.bus_ms / 1000.0, estimate.flash_ms / 1000.0, estimate.refresh_ms / 1000.0, estimate.reset_ms / 1000.0,
+        estimate.wait_ms / 1000.0, estimate.total_ms / 1000.0))
@@ -0,0 +1,279 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Program the firmware and configuration of many boards at the same time, each board on its own Aardvark dongle.
+# The boards are listed in a manifest, every dongle is served by its own worker process, which runs the same steps as
+# ADM1266 Load Firmware and Configuration.py. The progress of all the boards is shown while they are programmed and a combined
+# summary of the firmware versions and CRCs of all the devices is printed at the end.
+# Example:
+#   python ADM1266_Fleet.py fleet.json
+# Manifest, a JSON object of dongle unique ID -> board, relative file paths are relative to the manifest:
+#   {
+#     "1845957160": {"name": "Board 1", "firmware": "Firmware Configuration Files/adm1266_v1.14.3.hex",
+#                    "devices": {"0x40": "Firmware Configuration Files/2 Board Demo-device@40.hex",
+#                                "0x42": "Firmware Configuration Files/2 Board Demo-device@42.hex"}},
+#     "1845957180": {"name": "Board 2", ...}
+#   }
+# firmware is optional, a device with null instead of a configuration file only gets the firmware.
+# The output of every worker goes to <dongle unique ID>.log in the log directory.
+
+import ADM1266_Lib
+import PMBus_I2C
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+LOG_DIR = 'fleet_logs'
+
+# Options of Program_Fleet, passed on to the worker processes
+Default_Options = {'firmware': True, 'config': True, 'reset': True, 'skip_current': False, 'differential': False,
+                   'verify': None, 'resume': None, 'simulate': False, 'log_dir': LOG_DIR}
+
+
+class device_result:
+    def __init__(self, address=None, firmware_rev=None, crc_status=None, verify=None):
+        self.address = address
+        self.firmware_rev = firmware_rev
+        self.crc_status = crc_status
+        # summary of the block verification, None if the blocks were not verified
+        self.verify = verify
+
+
+class board_result:
+    def __init__(self, dongle_id=None, name=None):
+        self.dongle_id = dongle_id
+        self.name = name
+        self.devices = []
+        # message of the exception which stopped the programming of the board, None if it completed
+        self.error = None
+        self.seconds = 0.0
+        self.log_file = None
+
+    def passed(self):
+        return self.error is None and all(device.crc_status == 0 for device in self.devices)
+
+
+def Dongle_Id(key):
+    return int(key) if key.isdigit() else key
+
+
+# Returns the boards of the manifest file as a dict of dongle unique ID -> {'name', 'firmware', 'addresses', 'config'},
+# config is the list of configuration files in the order of addresses, None for a device without configuration file.
+def Load_Manifest(file):
+    with open(file, 'r') as json_file:
+        manifest = json.load(json_file)
+    directory = os.path.dirname(os.path.abspath(file))
+
+    def path(name):
+        return None if name is None else os.path.join(directory, name)
+
+    boards = {}
+    for key in manifest:
+        board = manifest[key]
+        if len(board.get('devices', {})) == 0:
+            raise Exception('Board of dongle ' + key + ' has no devices.')
+        addresses = sorted(int(address, 0) for address in board['devices'])
+        config = [path(board['devices'][address]) for address in sorted(board['devices'], key=lambda x: int(x, 0))]
+        if any(name is None for name in config) and not all(name is None for name in config):
+            raise Exception('Board of dongle ' + key + ' needs a configuration file for every device or for none.')
+        boards[Dongle_Id(key)] = {'name': board.get('name', key), 'firmware': path(board.get('firmware')),
+                                  'addresses': addresses, 'config': config}
+    return boards
+
+
+def Open_Board(dongle_id, board, simulate):
+    if simulate:
+        import ADM1266_Sim
+        transport = ADM1266_Sim.Sim_Transport()
+        for device_address in board['addresses']:
+            transport.add_device(device_address)
+        transport.dongle_id = dongle_id
+        PMBus_I2C.Set_Transport(transport)
+    else:
+        PMBus_I2C.Open_Aardvark(dongle_id)
+
+
+# Returns the device_result of every device, after the CRCs were recalculated.
+# reports are the block_verification reports returned by ADM1266_Lib.program_configration, None without verification.
+def Board_Summary(device_addresses, reports=None):
+    ADM1266_Lib.recalculate_crc_all()
+    devices = []
+    for x in range(len(device_addresses)):
+        device_address = device_addresses[x]
+        report = None if reports is None else reports[x]
+        devices.append(device_result(device_address, list(ADM1266_Lib.get_firmware_rev(device_address)),
+                                     ADM1266_Lib.all_crc_status(device_address),
+                                     None if report is None else ADM1266_Lib.verify_summary(report)))
+    return devices
+
+
+# Worker process, programs one board and returns its board_result.
+# The progress is put on queue as (dongle unique ID, device address, phase, records written, number of records).
+def Program_Board(dongle_id, board, options, queue):
+    result = board_result(dongle_id, board['name'])
+    start = time.time()
+    stdout = sys.stdout
+    if options['log_dir'] is not None:
+        if not os.path.isdir(options['log_dir']):
+            os.makedirs(options['log_dir'])
+        result.log_file = os.path.join(options['log_dir'], '{0}.log'.format(dongle_id))
+        sys.stdout = open(result.log_file, 'w')
+
+    def progress(device_address, phase, done, total):
+        queue.put((dongle_id, device_address, phase, done, total))
+
+    try:
+        Open_Board(dongle_id, board, options['simulate'])
+        ADM1266_Lib.ADM1266_Address = board['addresses']
+        ADM1266_Lib.firmware_file_name = board['firmware']
+        ADM1266_Lib.config_file_name = board['config']
+        ADM1266_Lib.Progress_Hook = progress
+        ADM1266_Lib.device_present()
+        if ADM1266_Lib.refresh_status():
+            raise Exception('Memory refresh is currently running, please try after 10 seconds.')
+        if options['firmware'] and board['firmware'] is not None:
+            ADM1266_Lib.program_firmware(options['skip_current'], options['resume'])
+        reports = None
+        if options['config'] and board['config'][0] is not None:
+            reports = ADM1266_Lib.program_configration(options['reset'], options['differential'], options['verify'],
+                                                       options['resume'])
+        result.devices = Board_Summary(board['addresses'], reports)
+    except Exception as e:
+        result.error = str(e)
+        print('Error: ' + result.error)
+    finally:
+        ADM1266_Lib.Progress_Hook = None
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        PMBus_I2C.Close_Aardvark()
+    result.seconds = time.time() - start
+    return result
+
+
+def Progress_Line(boards, progress):
+    entries = []
+    for dongle_id in boards:
+        devices = []
+        for device_address in boards[dongle_id]['addresses']:
+            state = progress.get((dongle_id, device_address))
+            if state is None:
+                devices.append('{0:#04x} -'.format(device_address))
+            else:
+                (phase, done, total) = state
+                devices.append('{0:#04x} {1} {2}%'.format(device_address, 'fw' if phase == 'firmware' else 'cfg',
+                                                         100 * done // max(1, total)))
+        entries.append('{0}: {1}'.format(boards[dongle_id]['name'], ', '.join(devices)))
+    return ' | '.join(entries)
+
+
+# Program all the boards of the manifest, one worker process per dongle. Returns the list of board_result in manifest order.
+# options are the keys of Default_Options, e.g. config=False to only program the firmware.
+def Program_Fleet(boards, processes=None, **options):
+    for key in options:
+        if key not in Default_Options:
+            raise Exception('Unknown option: ' + key)
+    worker_options = dict(Default_Options)
+    worker_options.update(options)
+
+    manager = multiprocessing.Manager()
+    queue = manager.Queue()
+    # (dongle unique ID, device address) -> (phase, records written, number of records)
+    progress = {}
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes if processes is not None else max(1, len(boards))) as executor:
+        futures = {}
+        for dongle_id in boards:
+            futures[executor.submit(Program_Board, dongle_id, boards[dongle_id], worker_options, queue)] = dongle_id
+        pending = set(futures)
+        line = ''
+        while len(pending) > 0:
+            (done, pending) = wait(pending, timeout=0.5)
+            while not queue.empty():
+                (dongle_id, device_address, phase, count, total) = queue.get()
+                progress[(dongle_id, device_address)] = (phase, count, total)
+            if Progress_Line(boards, progress) != line:
+                # padded with spaces to the length of the line before, so no text of a longer line is left over
+                previous = len(line)
+                line = Progress_Line(boards, progress)
+                sys.stdout.write('\r' + line.ljust(previous))
+                sys.stdout.flush()
+        sys.stdout.write('\n')
+        for future in futures:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = board_result(futures[future], boards[futures[future]]['name'])
+                results[futures[future]].error = str(e)
+    manager.shutdown()
+    return [results[dongle_id] for dongle_id in boards]
+
+
+# Same summary as ADM1266_Lib.crc_summary, for all the boards.
+def Print_Fleet_Report(results):
+    print("\n\nFleet Programming Summary")
+    print("---------------------------------------")
+    for result in results:
+        print('\n{0} (dongle {1}), {2:.1f} s'.format(result.name, result.dongle_id, result.seconds))
+        if result.error is not None:
+            print('  Failed: ' + result.error)
+        for device in result.devices:
+            print('  Firmware version in device {0:#04x} is v{1}.{2}.{3}'.format(device.address, *device.firmware_rev))
+            if device.crc_status > 0:
+                print('  The following CRC failed in device {0:#04x}: '.format(device.address) +
+                      ', '.join(ADM1266_Lib.crc_name[y] for y in range(0, 12) if (device.crc_status >> y) & 1))
+            else:
+                print('  All CRC passed in device {0:#04x}.'.format(device.address))
+            if device.verify is not None:
+                print('  ' + device.verify)
+        if result.log_file is not None:
+            print('  Log: ' + result.log_file)
+    passed = len([result for result in results if result.passed()])
+    print('\n{0} of {1} boards passed.'.format(passed, len(results)))
+
+
+def Write_Report(results, file):
+    boards = []
+    for result in results:
+        boards.append({'dongle': result.dongle_id, 'name': result.name, 'passed': result.passed(), 'error': result.error,
+                       'seconds': result.seconds, 'log': result.log_file,
+                       'devices': [{'address': device.address, 'firmware_rev': device.firmware_rev,
+                                    'crc_status': device.crc_status, 'verify': device.verify} for device in result.devices]})
+    with open(file, 'w') as json_file:
+        json.dump(boards, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Program the ADM1266 of many boards, one Aardvark dongle per board.')
+    parser.add_argument('manifest', help='JSON manifest: dongle unique ID -> name, firmware file and devices')
+    parser.add_argument('--firmware-only', action='store_true', help='only program the firmware')
+    parser.add_argument('--config-only', action='store_true', help='only program the configuration')
+    parser.add_argument('--seamless', action='store_true', help='seamless reset instead of a sequence reset after the update')
+    parser.add_argument('--skip-current', action='store_true', help='skip devices which already run the firmware')
+    parser.add_argument('--differential', action='store_true', help='only write the configuration blocks which differ')
+    parser.add_argument('--verify', action='store_true', help='read back every configuration block while programming')
+    parser.add_argument('--resume', action='store_true', help='go on where an interrupted programming stopped')
+    parser.add_argument('--simulate', action='store_true', help='program simulated devices instead of the dongles')
+    parser.add_argument('--processes', type=int, help='number of worker processes, one per dongle by default')
+    parser.add_argument('--log-dir', default=LOG_DIR, help='directory of the worker logs')
+    parser.add_argument('--report', help='write the summary to this JSON file')
+    args = parser.parse_args()
+
+    results = Program_Fleet(Load_Manifest(args.manifest), args.processes, firmware=not args.config_only,
+                            config=not args.firmware_only, reset=not args.seamless, skip_current=args.skip_current,
+                            differential=args.differential, verify=args.verify or None, resume=args.resume or None,
+                            simulate=args.simulate, log_dir=args.log_dir)
+    Print_Fleet_Report(results)
+    if args.report is not None:
+        Write_Report(results, args.report)
+    if not all(result.passed() for result in results):
+        sys.exit(1)
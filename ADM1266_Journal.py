@@ -0,0 +1,161 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Checkpoint journal of the programming of each device, so an interrupted program_configration or program_firmware
+# can be run again and goes on where it stopped instead of starting over.
+# The journal of a device holds the SHA-256 of the hex file, the phase and the last record which was fully written, i.e.
+# written and its delay or ready poll done. It is saved in Journal_Dir, one JSON file per dongle and device address.
+# Example:
+#   ADM1266_Lib.program_configration(resume=True)
+#   ... the link drops, the same call again writes only what is left
+#   ADM1266_Lib.program_configration(resume=True)
+
+import ADM1266_Lib
+import PMBus_I2C
+import atomic_file
+import json
+import os
+
+# Phases of the programming of a device
+PHASE_UNLOCKED = 'unlocked'
+# firmware records are written, the device runs the bootloader
+PHASE_IAP = 'iap'
+# configuration records are written
+PHASE_CONFIG = 'config'
+# all configuration records are written, the memory refresh is not done yet
+PHASE_REFRESH = 'refresh'
+# all firmware records are written, the system reset is not done yet
+PHASE_RESET = 'reset'
+
+# Directory of the journals, None to not keep journals
+Journal_Dir = os.path.join(os.path.expanduser('~'), '.adm1266', 'journal')
+
+
+class Device_Journal:
+    def __init__(self, device_address, digest, firmware, num_records, dongle_id=None):
+        self.device_address = device_address
+        self.digest = digest
+        self.firmware = firmware
+        self.num_records = num_records
+        self.dongle_id = dongle_id
+        self.phase = PHASE_UNLOCKED
+        # index of the last record fully written, -1 if none
+        self.record = -1
+        # id of a record of the plan -> its index, the same record tuple can be written again when a block is verified
+        self.index = {}
+
+    def to_dict(self):
+        return {'address': self.device_address, 'digest': self.digest, 'firmware': self.firmware,
+                'records': self.num_records, 'phase': self.phase, 'record': self.record}
+
+    def file(self):
+        return Journal_File(self.device_address, self.dongle_id)
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self.save()
+
+    # Mark the record of the plan as fully written.
+    def written(self, record):
+        index = self.index.get(id(record))
+        if index is not None:
+            self.record = index
+            self.save()
+
+    def save(self):
+        if Journal_Dir is None:
+            return
+        try:
+            if not os.path.isdir(Journal_Dir):
+                os.makedirs(Journal_Dir)
+            with atomic_file.atomic_file(self.file(), 'w') as json_file:
+                json.dump(self.to_dict(), json_file)
+        except (IOError, OSError):
+            # without the journal the programming still works, it only cannot be resumed
+            pass
+
+    def clear(self):
+        Clear_Journal(self.device_address, self.dongle_id)
+
+
+def Journal_File(device_address, dongle_id=None):
+    return os.path.join(Journal_Dir, '{0}_{1:02X}.json'.format('bus' if dongle_id is None else dongle_id, device_address))
+
+
+# Remove the journal of the device, once its programming is complete.
+def Clear_Journal(device_address, dongle_id=None):
+    if dongle_id is None:
+        dongle_id = getattr(PMBus_I2C.Get_Transport(), 'dongle_id', None)
+    if Journal_Dir is not None and os.path.exists(Journal_File(device_address, dongle_id)):
+        os.remove(Journal_File(device_address, dongle_id))
+
+
+# Returns the Device_Journal of the device for the plan. The saved journal is used if it is for the same file and plan,
+# otherwise the journal starts at the beginning.
+def Open_Journal(device_address, plan):
+    dongle_id = getattr(PMBus_I2C.Get_Transport(), 'dongle_id', None)
+    journal = Device_Journal(device_address, plan.digest, plan.firmware, len(plan.records), dongle_id)
+    journal.index = dict((id(plan.records[i]), i) for i in range(len(plan.records)))
+    if Journal_Dir is None or not os.path.exists(journal.file()):
+        return journal
+    try:
+        with open(journal.file(), 'r') as json_file:
+            saved = json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return journal
+    if (saved.get('digest') == plan.digest and saved.get('firmware') == plan.firmware and
+            saved.get('records') == len(plan.records)):
+        journal.phase = saved.get('phase', PHASE_UNLOCKED)
+        journal.record = saved.get('record', -1)
+    return journal
+
+
+# Returns the index of the first record of the section of records[index]. The records of a block command are one section,
+# its first record erases the block, every other record is a section by itself.
+def Section_Start(records, index):
+    cmd = records[index][0]
+    if cmd not in ADM1266_Lib.Diff_Block_Commands:
+        return index
+    while index > 0 and records[index - 1][0] == cmd:
+        index -= 1
+    return index
+
+
+# Returns the index of the 0x00 record which set the PAGE for records[index], 0 if there is none before it.
+# The paged commands are written to the page the device is on, which is not the same any more when the device was power
+# cycled or the PAGE was reset in between, so they are only written again after the PAGE record.
+def Page_Start(records, index):
+    while index > 0 and records[index][0] != 0x00:
+        index -= 1
+    return index
+
+
+# Returns the index of the record to resume the configuration at, the start of the section of the first record not written.
+# A record which is not a block write goes back to the PAGE record before it.
+def Resume_Config(records, journal):
+    if journal.phase == PHASE_REFRESH:
+        return len(records)
+    if journal.phase != PHASE_CONFIG:
+        return 0
+    if journal.record + 1 >= len(records):
+        return len(records)
+    start = Section_Start(records, journal.record + 1)
+    if records[start][0] not in ADM1266_Lib.Diff_Block_Commands:
+        start = Page_Start(records, start)
+    return start
+
+
+# Returns the index of the record to resume the firmware at, None if the firmware has to start again with the jump to IAP.
+# The first record erases the firmware, after it every record is written at its own offset, so the device which is still
+# in IAP goes on with the record after the last one written. The caller has to check that the device is still in IAP.
+def Resume_Firmware(records, journal):
+    if journal.phase == PHASE_RESET:
+        return len(records)
+    if journal.phase != PHASE_IAP or journal.record < 0:
+        return None
+    return journal.record + 1
@@ -7,11 +7,20 @@
 #
 
 import PMBus_I2C
-from encodings import hex_codec
-import codecs
+import ADM1266_Plan
+import ADM1266_Journal
+import ADM1266_Estimate
+import hex_records
+import asyncio
+import contextvars
+import functools
+import hashlib
+import itertools
 from time import *
 from array import array
 import math
+import os
+import re
 import sys
 
 if sys.version_info.major < 3:
@@ -33,39 +42,176 @@ crc_name = ['Main Mini Bootloader CRC', 'Main Bootloader CRC', 'Backup Mini Boot
             'Backup Firmware CRC', 'Backup Password CRC']
 
 
+# Name of the programming operation running in this thread or asyncio task, the delays are reported to Delay_Hook under it,
+# so the time of program_hex is reported as program_hex and not as the helpers it calls, e.g. unlock or write_records.
+Operation = contextvars.ContextVar('operation', default=None)
+
+
+# Decorator of the public programming functions, the delays while the function runs are reported under its name.
+# When one calls another the delays are reported under the inner one, e.g. program_configration and program_hex_interleaved.
+# Coroutine functions are decorated the same way, e.g. ADM1266_Async.program_hex.
+def operation(function):
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def run_async(*args, **kwargs):
+            token = Operation.set(function.__name__)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                Operation.reset(token)
+        return run_async
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        token = Operation.set(function.__name__)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            Operation.reset(token)
+    return run
+
+
+# Returns the name the delay is reported under, the operation running or else the function which called delay.
+def delay_caller(frame):
+    name = Operation.get()
+    return name if name is not None else frame.f_code.co_name
+
+
 # Based on the number of devices the following function calls subfunction to pause the sequence, program firmware hex, and do a system (ADM1266 CPU) reset.
 
-def program_firmware():
-    for x in range(len(ADM1266_Address)):
-        pause_sequence(ADM1266_Address[x])
+# With skip_current set, the devices which already run the firmware version of the file and pass all CRCs are not programmed.
+
+# With resume set a programming which was interrupted goes on where it stopped, see Resume_Programming.
+# With dry_run set nothing is programmed, the time it would take is estimated and printed, see ADM1266_Estimate.
+
+@operation
+def program_firmware(skip_current=False, resume=None, dry_run=False):
+    resume = Resume_Programming if resume is None else resume
+    device_addresses = ADM1266_Address
+    if skip_current:
+        plan = plan_firmware(ADM1266_Address, firmware_file_name)
+        print_firmware_plan(plan, firmware_file_name)
+        device_addresses = [entry.address for entry in plan if entry.update]
+        if len(device_addresses) == 0:
+            return
+    if dry_run:
+        (devices, system) = ADM1266_Estimate.Estimate_Firmware(device_addresses, firmware_file_name, poll=Poll_Ready)
+        return ADM1266_Estimate.Print_Estimate(devices, system, 'Estimated Firmware Programming Time')
+
+    pause_sequence_all(device_addresses=device_addresses)
+
+    for x in range(len(device_addresses)):
+        print('Loading firmware to device {0:#04x}.'.format(device_addresses[x]))
+        program_firmware_hex(device_addresses[x], firmware_file_name, True, resume=resume)
+    system_reset_all(device_addresses)
+    if resume:
+        for device_address in device_addresses:
+            ADM1266_Journal.Clear_Journal(device_address)
+
+
+class firmware_update:
+    def __init__(self, address=None, firmware_rev=None, crc_status=None, update=True, reason=""):
+        self.address = address
+        self.firmware_rev = firmware_rev
+        self.crc_status = crc_status
+        self.update = update
+        self.reason = reason
+
+
+# Returns the firmware version in the name of the firmware file as [major, minor, patch], e.g. adm1266_v1.14.3.hex, or None.
+
+def firmware_file_version(file):
+    match = re.search(r'v(\d+)\.(\d+)\.(\d+)', os.path.basename(file))
+    if match is None:
+        return None
+    return [int(match.group(1)), int(match.group(2)), int(match.group(3))]
+
+
+# Decide which devices need the firmware file, returns a firmware_update for every device.
+# The firmware revision and the CRC status of each device are read in one batch. A device is programmed if its revision
+# differs from version (by default the version in the file name), or if any CRC fails. To plan several buses at the same
+# time, run this function on every bus with PMBus_Pool.
+
+def plan_firmware(device_addresses, file, version=None):
+    if version is None:
+        version = firmware_file_version(file)
+    plan = []
+    for device_address in device_addresses:
+        (rev, crc) = PMBus_I2C.PMBus_Batch_Write_Read(device_address, [([0xAE], 9), ([0xED], 2)])
+        if len(rev) != 9 or len(crc) != 2:
+            plan.append(firmware_update(device_address, None, None, True, 'no response'))
+            continue
+        firmware_rev = list(rev[1:4])
+        crc_status = (crc[0] + (crc[1] << 8)) >> 4
+        if version is None:
+            entry = firmware_update(device_address, firmware_rev, crc_status, True, 'file version unknown')
+        elif firmware_rev != list(version):
+            entry = firmware_update(device_address, firmware_rev, crc_status, True, 'version differs')
+        elif crc_status != 0:
+            entry = firmware_update(device_address, firmware_rev, crc_status, True, 'CRC failed')
+        else:
+            entry = firmware_update(device_address, firmware_rev, crc_status, False, 'up to date')
+        plan.append(entry)
+    return plan
 
-    for x in range(len(ADM1266_Address)):
-        print('Loading firmware to device {0:#04x}.'.format(ADM1266_Address[x]))
-        program_firmware_hex(ADM1266_Address[x], firmware_file_name, True)
-        system_reset(ADM1266_Address[x])
+
+# The time saved is the time ADM1266_Estimate.Estimate_Firmware predicts for the devices which are skipped.
+
+def print_firmware_plan(plan, file):
+    print('\nFirmware update plan for ' + os.path.basename(file))
+    print("---------------------------------------")
+    for entry in plan:
+        if entry.firmware_rev is None:
+            rev = 'unknown'
+        else:
+            rev = 'v{0}.{1}.{2}'.format(*entry.firmware_rev)
+        print('Device {0:#04x}: {1:<10} {2:<8} {3}'.format(entry.address, rev, 'update' if entry.update else 'skip', entry.reason))
+    skipped = [entry.address for entry in plan if not entry.update]
+    saved_ms = 0.0
+    if len(skipped) > 0:
+        (devices, system) = ADM1266_Estimate.Estimate_Firmware(skipped, file, poll=Poll_Ready)
+        saved_ms = sum(devices[device_address].total_ms for device_address in skipped)
+    print('{0} of {1} devices to update, estimated time saved {2:.1f} s.\n'.format(len(plan) - len(skipped), len(plan),
+                                                                                   saved_ms / 1000.0))
 
     # Based on the number devices the following function calls sub function to pause sequence, program the hex file, start the sequence and trigger memory refresh.
 
 
 # If the number of configuration file provided is not equal to the number of PMBus address of the device the following function will not proceed.
 
-def program_configration(reset=True):
+# With differential set only the configuration blocks which differ from the ones in the devices are written, see program_hex_diff.
+# With verify set every block record is read back while the next records are written, see Verify_Blocks.
+# With resume set a programming which was interrupted goes on where it stopped, see Resume_Programming.
+# With dry_run set nothing is programmed, the time it would take is estimated and printed, see ADM1266_Estimate.
+# With verify set the block_verification reports of the devices are returned in the order of ADM1266_Address, pass them to
+# crc_summary, otherwise None is returned.
+
+@operation
+def program_configration(reset=True, differential=False, verify=None, resume=None, dry_run=False):
+    resume = Resume_Programming if resume is None else resume
+    if len(ADM1266_Address) == len(config_file_name) and dry_run:
+        (devices, system) = ADM1266_Estimate.Estimate_Configuration(ADM1266_Address, config_file_name, verify=verify,
+                                                                    differential=differential, poll=Poll_Ready)
+        return ADM1266_Estimate.Print_Estimate(devices, system, 'Estimated Configuration Programming Time')
     if len(ADM1266_Address) == len(config_file_name):
-        for x in range(len(ADM1266_Address)):
-            pause_sequence(ADM1266_Address[x], reset)
+        pause_sequence_all(reset)
 
-        for x in range(len(ADM1266_Address)):
-            print('Loading configuration to device {0:#04x}.'.format(ADM1266_Address[x]))
-            program_hex(ADM1266_Address[x], config_file_name[x])
+        print('Loading configuration to devices ' + ', '.join('{0:#04x}'.format(x) for x in ADM1266_Address) + '.')
+        reports = program_hex_interleaved(ADM1266_Address, config_file_name, differential=differential, verify=verify,
+                                          resume=resume)
+        if reports is not None:
+            print_verify_reports(reports)
 
-        for x in range(len(ADM1266_Address)):
-            start_sequence(ADM1266_Address[x])
+        start_sequence_all()
 
-        for x in range(len(ADM1266_Address)):
-            unlock(ADM1266_Address[x])
-            refresh_flash(ADM1266_Address[x])
+        unlock_all()
+        refresh_flash_all()
         print('Running Memory Refresh.')
         delay(10000)
+        if resume:
+            for device_address in ADM1266_Address:
+                ADM1266_Journal.Clear_Journal(device_address)
+        return reports
 
     else:
         print("Number of devices does not match with number of configuration files provided.")
@@ -73,18 +219,21 @@ def program_configration(reset=True):
 
 # Reads back the firmware version number and checks for the CRC error.
 # If there is any CRC error it will display which CRC is failing or else display "All CRC Passed"
+# reports are the block_verification reports returned by program_configration, printed for each device.
 
-def crc_summary():
+def crc_summary(reports=None):
     print("\n\nProgramming Summary")
     print("---------------------------------------")
 
+    recalculate_crc_all()
     for x in range(len(ADM1266_Address)):
-        recalculate_crc(ADM1266_Address[x])
         crc_status = all_crc_status(ADM1266_Address[x])
         fw_version = get_firmware_rev(ADM1266_Address[x])
         print(
             '\nFirmware version in device {3:#04x} is v{0}.{1}.{2} '.format(fw_version[0], fw_version[1], fw_version[2],
                                                                             ADM1266_Address[x]))
+        if reports is not None:
+            print(verify_summary(reports[x]))
 
         if crc_status > 0:
             print('The following CRC failed in device {0:#04x}:'.format(ADM1266_Address[x]))
@@ -98,76 +247,427 @@ def crc_summary():
 # Based on the number of devices the following function checks if there is a bootloader and the part is unlocked.
 # If the part is not unlocked then unlock the part.
 
-def program_firmware_hex(device_address, file, unlock_part):
-    bootloadVer = get_bootload_rev(device_address)
-    if bootloadVer != array('B', [0, 0, 0]):
-        if unlock_part:
-            unlock(device_address)
-            assert islocked(device_address) == False, 'device @0x{0:02X} should be unlocked!'.format(i2c_address)
-        jump_to_iap(device_address)
-
-    hex = open(file, "rb")
-
-    count = 0
-
-    for line in hex.readlines():
-        if (line.startswith(b":00000001FF")):
-            break
-        data_len = int(line[1:3], 16)
-        cmd = int(line[3:7], 16)
-        # data = [] if data_len == 0 else array('B', line[9:9 + data_len * 2].decode("hex")).tolist()
-        data = [] if data_len == 0 else array('B', codecs.decode((line[9:9 + data_len * 2]), "hex_codec")).tolist()
+# With resume set a device whose journal shows it is still in IAP with the same firmware file goes on with the next record.
+
+@operation
+def program_firmware_hex(device_address, file, unlock_part, poll=None, resume=None):
+    poll = Poll_Ready if poll is None else poll
+    resume = Resume_Programming if resume is None else resume
+    plan = load_plan(file, True)
+    journal = ADM1266_Journal.Open_Journal(device_address, plan) if resume else None
+    start = ADM1266_Journal.Resume_Firmware(plan.records, journal) if resume else None
+    if start is not None and start < len(plan.records) and not still_in_iap(device_address):
+        print('Device {0:#04x} is not in IAP any more, the firmware starts again.'.format(device_address))
+        start = None
+
+    if start is None:
+        start = 0
+        if journal is not None:
+            journal.record = -1
+        bootloadVer = get_bootload_rev(device_address)
+        if bootloadVer != array('B', [0, 0, 0]):
+            if unlock_part:
+                unlock(device_address)
+                assert islocked(device_address) == False, 'device @0x{0:02X} should be unlocked!'.format(i2c_address)
+                if journal is not None:
+                    journal.set_phase(ADM1266_Journal.PHASE_UNLOCKED)
+            jump_to_iap(device_address)
+        if journal is not None:
+            journal.set_phase(ADM1266_Journal.PHASE_IAP)
+    else:
+        print('Resuming firmware of device {0:#04x} at record {1} of {2}.'.format(device_address, start, len(plan.records)))
 
+    for index in range(start, len(plan.records)):
+        record = plan.records[index]
+        (cmd, write_data, delayMs) = record
         if cmd != 0xD8:
-            PMBus_I2C.PMBus_Write(device_address, [cmd] + data)
-        if count == 0:
-            count = 1
-            delay(3000)
+            PMBus_I2C.PMBus_Write(device_address, write_data)
+        if poll and cmd != 0xD8:
+            wait_ready(device_address, delayMs)
         else:
-            delay(10)
+            delay(delayMs)
+        if journal is not None:
+            journal.written(record)
+        if Progress_Hook is not None:
+            Progress_Hook(device_address, 'firmware', index + 1, len(plan.records))
+    if journal is not None:
+        journal.set_phase(ADM1266_Journal.PHASE_RESET)
 
 
 # The following function unlocks the ADM1266 (if locked), pause sequence, points to main memory, writes the configuration to the part with respective delays
 
-def program_hex(device_address, file, unlock_and_stop=True, main=True):
-    hex = open(file, "rb")
+# With verify set the block records are read back and a block_verification report is returned, see Verify_Blocks.
+
+@operation
+def program_hex(device_address, file, unlock_and_stop=True, main=True, poll=None, verify=None):
+    poll = Poll_Ready if poll is None else poll
+    plan = load_plan(file)
     if unlock_and_stop:
         unlock(device_address)
         assert islocked(device_address) == False, 'device @0x{0:02X} should be unlocked!'.format(i2c_address)
     switch_memory(device_address, main)
-    for line in hex.readlines():
-        if (line.startswith(b":00000001FF")):
+    return write_records(device_address, plan.records, poll, verify)
+
+
+# Same as program_hex, but the 0xD7, 0xE3, 0xE0 and 0xD6 blocks are first read back from the device and only the blocks which
+# differ from the file are erased and written. The other records are always written. Returns the commands of the blocks written.
+
+@operation
+def program_hex_diff(device_address, file, unlock_and_stop=True, main=True, poll=None, verify=None):
+    poll = Poll_Ready if poll is None else poll
+    if unlock_and_stop:
+        unlock(device_address)
+        assert islocked(device_address) == False, 'device @0x{0:02X} should be unlocked!'.format(device_address)
+    switch_memory(device_address, main)
+    (records, changed) = diff_records(device_address, file)
+    write_records(device_address, records, poll, verify)
+    return changed
+
+
+# Write (cmd, write data, delay in ms) records to the device, each followed by its delay.
+# With verify set every block record is read back before the next record is written, returns the block_verification report
+# or None if verify is not set.
+
+def write_records(device_address, records, poll, verify=None):
+    verify = Verify_Blocks if verify is None else verify
+    report = block_verification(device_address, records) if verify else None
+    stream = iter(records)
+    pending = None
+    while True:
+        if pending is not None:
+            stream = verify_block_record(report, pending, stream)
+            pending = None
+        record = next(stream, None)
+        if record is None:
             break
-        data_len = int(line[1:3], 16)
-        cmd = int(line[3:7], 16)
-        # data = [] if data_len == 0 else array('B', line[9:9 + data_len * 2].decode("hex")).tolist()
-        data = [] if data_len == 0 else array('B', codecs.decode((line[9:9 + data_len * 2]), "hex_codec")).tolist()
+        (cmd, write_data, delayMs) = record
         if cmd != 0xD8:
-            PMBus_I2C.PMBus_Write(device_address, [cmd] + data)
-        delayMs = 0
-        offset = 0
-        if cmd == 0xD8:
-            delayMs = 100
-        elif cmd == 0x15:
-            delayMs = 300
-        elif cmd == 0xD7:
-            offset = (data[1] | (data[2] << 8))
-            delayMs = 400 if offset == 0 else 40
-        elif cmd == 0xE3:
-            offset = (data[1] | (data[2] << 8))
-            delayMs = 100 if offset == 0 else 40
-        elif cmd == 0xE0:
-            offset = (data[1] | (data[2] << 8))
-            delayMs = 200 if offset == 0 else 40
-        elif cmd == 0xD6:
-            if data[1] == 0xff and data[2] == 0xff:
-                pageCount = data[3]
-                delayMs = 100 + (pageCount - 1) * 30
+            PMBus_I2C.PMBus_Write(device_address, write_data)
+        if report is not None and report.verifies(record):
+            pending = record
+        if poll and cmd != 0xD8:
+            wait_ready(device_address, delayMs)
+        else:
+            delay(delayMs)
+    return report
+
+
+# Block commands of the configuration compared with the device by program_hex_diff
+Diff_Block_Commands = [0xD7, 0xE3, 0xE0, 0xD6]
+
+
+# Returns the records of the file which have to be written to the device and the list of block commands which differ.
+# The device has to be unlocked and the memory to compare with selected.
+
+def diff_records(device_address, file):
+    records = load_plan(file).records
+    changed = []
+    for cmd in Diff_Block_Commands:
+        section = [record for record in records if record[0] == cmd]
+        if len(section) > 0 and block_digest(section) != device_block_digest(device_address, section):
+            changed.append(cmd)
+    if len(changed) > 0:
+        print('Configuration blocks changed in device {0:#04x}: '.format(device_address) +
+              ', '.join('{0:#04x}'.format(cmd) for cmd in changed))
+    else:
+        print('Configuration blocks of device {0:#04x} are up to date.'.format(device_address))
+    return ([record for record in records if record[0] not in Diff_Block_Commands or record[0] in changed], changed)
+
+
+# Returns (offset, data) of every block write record, block writes are [cmd, count, offset low, offset high, data].
+# The 0xD6 erase record, with offset 0xFFFF, does not write data.
+
+def block_writes(section):
+    writes = []
+    for (cmd, write_data, delayMs) in section:
+        if len(write_data) < 4:
+            continue
+        offset = write_data[2] | (write_data[3] << 8)
+        if offset != 0xFFFF:
+            writes.append((offset, bytes(write_data[4:2 + write_data[1]])))
+    return writes
+
+
+def block_digest(section):
+    digest = hashlib.sha256()
+    for (offset, data) in block_writes(section):
+        digest.update(data)
+    return digest.digest()
+
+
+# Read back the bytes the block section writes with the same block reads as System_Read and return their digest.
+
+def device_block_digest(device_address, section):
+    cmd = section[0][0]
+    writes = block_writes(section)
+    read_data = PMBus_I2C.PMBus_Batch_Write_Read(device_address, [([cmd, 0x03, len(data), offset & 0xFF, offset >> 8], len(data) + 1)
+                                                                  for (offset, data) in writes])
+    digest = hashlib.sha256()
+    for (data, block) in zip([data for (offset, data) in writes], read_data):
+        digest.update(bytes(bytearray(block[1:len(data) + 1])))
+    return digest.digest()
+
+
+# When Verify_Blocks is set, program_hex, program_hex_diff and program_hex_interleaved read back every block record of the
+# Diff_Block_Commands once the device is ready again, just before its next record is written. A block which does not read back
+# as written is erased and written again right away, up to VERIFY_RETRIES times. The CRC check after programming then only
+# confirms what the verification already found.
+Verify_Blocks = False
+VERIFY_RETRIES = 2
+
+
+class block_verification:
+    def __init__(self, address=None, records=[]):
+        self.address = address
+        # records of each block, written again if one of them does not read back correctly
+        self.blocks = {}
+        for record in records:
+            if record[0] in Diff_Block_Commands:
+                self.blocks.setdefault(record[0], []).append(record)
+        self.verified = 0
+        self.mismatches = 0
+        # block command -> number of times the block was written again
+        self.rewritten = {}
+        # block commands which still did not read back correctly after VERIFY_RETRIES
+        self.failed = []
+
+    def verifies(self, record):
+        return record[0] in self.blocks and ADM1266_Plan.Block_Offset(record[0], record[1]) is not None
+
+    def passed(self):
+        return len(self.failed) == 0
+
+
+# Read back the block record and compare it with the data written. If it differs, returns the stream of records to write next
+# with the whole block first and the records of the block left in stream removed, otherwise returns stream.
+
+def verify_block_record(report, record, stream):
+    (cmd, write_data, delayMs) = record
+    offset = ADM1266_Plan.Block_Offset(cmd, write_data)
+    data = bytearray(write_data[4:])
+    read_data = PMBus_I2C.PMBus_Write_Read(report.address, [cmd, 0x03, len(data), offset & 0xFF, offset >> 8], len(data) + 1)
+    report.verified += 1
+    if bytearray(read_data[1:]) == data:
+        return stream
+    report.mismatches += 1
+    if cmd in report.failed:
+        return stream
+    if report.rewritten.get(cmd, 0) >= VERIFY_RETRIES:
+        report.failed.append(cmd)
+        print('Block {0:#04x} of device {1:#04x} failed verification at offset {2:#06x}.'.format(cmd, report.address, offset))
+        return stream
+    report.rewritten[cmd] = report.rewritten.get(cmd, 0) + 1
+    print('Block {0:#04x} of device {1:#04x} differs at offset {2:#06x}, writing the block again.'.format(cmd, report.address,
+                                                                                                        offset))
+    return itertools.chain(report.blocks[cmd], (x for x in stream if x[0] != cmd))
+
+
+def verify_summary(report):
+    summary = 'Block verification of device {0:#04x}: {1} records read back'.format(report.address, report.verified)
+    if len(report.rewritten) > 0:
+        summary += ', written again: ' + ', '.join('{0:#04x} ({1}x)'.format(cmd, report.rewritten[cmd])
+                                                 for cmd in sorted(report.rewritten))
+    if report.passed():
+        return summary + ', all blocks verified.'
+    return summary + ', failed: ' + ', '.join('{0:#04x}'.format(cmd) for cmd in report.failed) + '.'
+
+
+def print_verify_reports(reports):
+    for report in reports:
+        print(verify_summary(report))
+
+
+# Program the configuration files to several devices on the same bus at the same time, files[x] is written to device_addresses[x].
+# While one device waits after a record, e.g. for a flash erase, the records of the other devices are written.
+# The records of every device are written in order and each one is followed by the wait program_hex would do.
+
+# With verify set every block record is read back before the next record of the device, returns the block_verification reports
+# in the order of device_addresses, or None if verify is not set.
+
+# With resume set the progress of every device is kept in its ADM1266_Journal and a device whose journal is for the same file
+# goes on at the section of the first record not written. Not used with differential, which only writes the blocks which differ.
+
+@operation
+def program_hex_interleaved(device_addresses, files, unlock_and_stop=True, main=True, poll=None, differential=False,
+                            verify=None, resume=None):
+    poll = Poll_Ready if poll is None else poll
+    verify = Verify_Blocks if verify is None else verify
+    resume = Resume_Programming if resume is None else resume
+    for device_address in device_addresses:
+        if unlock_and_stop:
+            unlock(device_address)
+            assert islocked(device_address) == False, 'device @0x{0:02X} should be unlocked!'.format(device_address)
+        switch_memory(device_address, main)
+
+    streams = {}
+    reports = {}
+    journals = {}
+    # device address -> [records written, number of records]
+    progress = {}
+    # last record written to each device, read back and marked in the journal once the device is ready
+    written = {}
+    for x in range(len(device_addresses)):
+        if differential:
+            records = diff_records(device_addresses[x], files[x])[0]
+        else:
+            plan = load_plan(files[x])
+            records = plan.records
+            if resume:
+                journal = ADM1266_Journal.Open_Journal(device_addresses[x], plan)
+                start = ADM1266_Journal.Resume_Config(records, journal)
+                if start > 0:
+                    print('Resuming configuration of device {0:#04x} at record {1} of {2}.'.format(device_addresses[x], start,
+                                                                                                  len(records)))
+                if start < len(records):
+                    journal.record = start - 1
+                    journal.set_phase(ADM1266_Journal.PHASE_CONFIG)
+                progress[device_addresses[x]] = [start, len(records)]
+                records = records[start:]
+                journals[device_addresses[x]] = journal
+        if device_addresses[x] not in progress:
+            progress[device_addresses[x]] = [0, len(records)]
+        streams[device_addresses[x]] = iter(records)
+        if verify:
+            reports[device_addresses[x]] = block_verification(device_addresses[x], records)
+    # time at which each device is ready for its next record, at the latest
+    ready_at = dict((device_address, 0) for device_address in device_addresses)
+    # devices which can be polled to find out if they got ready earlier
+    polling = set()
+
+    while len(streams) > 0:
+        now = time()
+        for device_address in list(polling):
+            if ready_at[device_address] <= now:
+                polling.discard(device_address)
             else:
-                delayMs = 40
-        elif cmd == 0xF8:
-            delayMs = 100
-        delay(delayMs)
+                status = PMBus_I2C.PMBus_Write_Read(device_address, [0x80], 1)
+                if len(status) == 1 and (status[0] & 0x08) == 0:
+                    ready_at[device_address] = now
+                    polling.discard(device_address)
+
+        device_address = min(streams, key=lambda x: ready_at[x])
+        wait = ready_at[device_address] - time()
+        if wait > 0:
+            if len(polling) > 0:
+                wait = min(wait, POLL_INTERVAL_MS / 1000.0)
+            sleep(wait)
+            if Delay_Hook is not None:
+                Delay_Hook(wait * 1000.0, wait, delay_caller(sys._getframe(0)))
+            continue
+
+        if device_address in written:
+            record = written.pop(device_address)
+            stream = streams[device_address]
+            if verify and reports[device_address].verifies(record):
+                streams[device_address] = verify_block_record(reports[device_address], record, stream)
+            if device_address in journals and streams[device_address] is stream:
+                journals[device_address].written(record)
+        record = next(streams[device_address], None)
+        if record is None:
+            del streams[device_address]
+            continue
+        (cmd, write_data, delayMs) = record
+        if cmd != 0xD8:
+            PMBus_I2C.PMBus_Write(device_address, write_data)
+            if poll:
+                polling.add(device_address)
+        written[device_address] = record
+        ready_at[device_address] = time() + (delayMs + 1) / 1000.0
+        if Progress_Hook is not None:
+            progress[device_address][0] += 1
+            Progress_Hook(device_address, 'config', min(progress[device_address]), progress[device_address][1])
+
+    for journal in journals.values():
+        journal.set_phase(ADM1266_Journal.PHASE_REFRESH)
+    if not verify:
+        return None
+    return [reports[device_address] for device_address in device_addresses]
+
+
+# Returns the time in ms the device needs after a configuration record is written, data is the record without the command code.
+
+def record_delay(cmd, data):
+    delayMs = 0
+    offset = 0
+    if cmd == 0xD8:
+        delayMs = 100
+    elif cmd == 0x15:
+        delayMs = 300
+    elif cmd == 0xD7:
+        offset = (data[1] | (data[2] << 8))
+        delayMs = 400 if offset == 0 else 40
+    elif cmd == 0xE3:
+        offset = (data[1] | (data[2] << 8))
+        delayMs = 100 if offset == 0 else 40
+    elif cmd == 0xE0:
+        offset = (data[1] | (data[2] << 8))
+        delayMs = 200 if offset == 0 else 40
+    elif cmd == 0xD6:
+        if data[1] == 0xff and data[2] == 0xff:
+            pageCount = data[3]
+            delayMs = 100 + (pageCount - 1) * 30
+        else:
+            delayMs = 40
+    elif cmd == 0xF8:
+        delayMs = 100
+    return delayMs
+
+
+# When Coalesce_Records is set, the plans run by program_hex and program_firmware_hex have their block write records (0xFC, 0xD7,
+# 0xE3, 0xE0, 0xD6) merged to records of MAX_BLOCK_PAYLOAD data bytes, e.g. for hex files split into small records by
+# hex_file_chopper. Only done if the transport declares with its max_write_length attribute that it can write them, and never
+# more than that in one transaction. With any other transport the records are written as they are in the file.
+Coalesce_Records = True
+MAX_BLOCK_PAYLOAD = 128
+
+
+# Returns the number of data bytes of the coalesced block write records, None if the records are not coalesced.
+
+def block_payload(transport=None):
+    if not Coalesce_Records:
+        return None
+    transport = PMBus_I2C.Get_Transport() if transport is None else transport
+    max_write_length = getattr(transport, 'max_write_length', None)
+    if max_write_length is None:
+        return None
+    # command code, byte count and offset
+    return max(1, min(MAX_BLOCK_PAYLOAD, max_write_length - 4))
+
+
+def load_plan(file, firmware=False, transport=None):
+    return ADM1266_Plan.Load_Plan(file, firmware, block_payload(transport))
+
+
+# When Resume_Programming is set, program_configration and program_firmware keep a journal of every device in
+# ADM1266_Journal.Journal_Dir. If the programming is interrupted, e.g. the link drops, running it again goes on at the last
+# safe point: the start of the configuration block which was being written, or the next firmware record.
+Resume_Programming = False
+
+
+# When Poll_Ready is set, program_hex and program_firmware_hex poll the device after every record and go on as soon as it is
+# ready, instead of always waiting the time from the delay table. The time from the table is still the longest wait.
+Poll_Ready = False
+POLL_INTERVAL_MS = 1
+
+
+# Wait until the device acknowledges a read of STATUS_MFR_SPECIFIC and no memory refresh is running, for at most timeout_ms.
+# The device does not acknowledge while it is writing its flash. Returns True if the device got ready in time.
+
+def wait_ready(device_address, timeout_ms):
+    start = time()
+    ready = False
+    while True:
+        status = PMBus_I2C.PMBus_Write_Read(device_address, [0x80], 1)
+        if len(status) == 1 and (status[0] & 0x08) == 0:
+            ready = True
+            break
+        elapsed_ms = (time() - start) * 1000.0
+        if elapsed_ms >= timeout_ms:
+            break
+        sleep(min(POLL_INTERVAL_MS, timeout_ms - elapsed_ms) / 1000.0)
+    if Delay_Hook is not None:
+        Delay_Hook(timeout_ms, time() - start, delay_caller(sys._getframe(1)))
+    return ready
 
 
 # All the functions from here onward writes to ADM1266 to perform different tasks
@@ -223,6 +723,43 @@ def start_sequence(device_address, reset=False):
     delay(500)
 
 
+# The following functions send the same command to all the devices in ADM1266_Address with one PMBus group command,
+# so all the devices act at the same time and the delay the command needs is only waited once.
+
+def refresh_flash_all(config=2):
+    PMBus_I2C.PMBus_Group_Write(ADM1266_Address, [0xF5, 0x01, config])
+
+
+def system_reset_all(device_addresses=None):
+    PMBus_I2C.PMBus_Group_Write(ADM1266_Address if device_addresses is None else device_addresses, [0xD8, 0x04, 0x00])
+    delay(1000)
+
+
+def recalculate_crc_all():
+    PMBus_I2C.PMBus_Group_Write(ADM1266_Address, [0xF9, 1, 0])
+    delay(600)
+
+
+def unlock_all(pwd=[0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff]):
+    assert len(pwd) == 16
+    for i in range(2):
+        PMBus_I2C.PMBus_Group_Write(ADM1266_Address, [0xFD, 0x11] + pwd + [0x02])
+        delay(1)
+
+
+def pause_sequence_all(reset_sequence=True, device_addresses=None):
+    PMBus_I2C.PMBus_Group_Write(ADM1266_Address if device_addresses is None else device_addresses,
+                                [0xD8, 0x03 if reset_sequence else 0x11, 0x00])
+    delay(10)
+
+
+def start_sequence_all(reset=False):
+    if reset:
+        PMBus_I2C.PMBus_Group_Write(ADM1266_Address, [0xD8, 0x02, 0x00])
+    PMBus_I2C.PMBus_Group_Write(ADM1266_Address, [0xD8, 0x00, 0x00])
+    delay(500)
+
+
 def switch_memory(device_address, main):
     PMBus_I2C.PMBus_Write(device_address, [0xFA, 1, 0 if main else 1])
 
@@ -251,14 +788,36 @@ def jump_to_iap(device_address):
     delay(1000)
 
 
+# Returns True if the device still runs the bootloader after jump_to_iap. The device is unlocked before the jump, a reset or a
+# power cycle locks it again and leaves IAP, so a device which does not respond or is locked has to start over.
+
+def still_in_iap(device_address):
+    status = status_mfr_specific(device_address)
+    return len(status) == 1 and (status[0] & 0x04) == 0
+
+
 def all_crc_status(device_address):
     status = PMBus_I2C.PMBus_Write_Read(device_address, [0xED], 2)
     status = status[0] + (status[1] << 8)
     return (status >> 4)
 
 
+# Called as Delay_Hook(ms, seconds slept, name of the operation or function which called delay) after every delay, see
+# PMBus_Stats and operation
+Delay_Hook = None
+
+# Called as Progress_Hook(device address, 'firmware' or 'config', records written, number of records) after every record
+# written by program_firmware_hex and program_hex_interleaved, see ADM1266_Fleet
+Progress_Hook = None
+
+
 def delay(ms):
-    sleep((ms + 1) / 1000.0)  # http://stackoverflow.com/questions/1133857/how-accurate-is-pythons-time-sleep
+    if Delay_Hook is None:
+        sleep((ms + 1) / 1000.0)  # http://stackoverflow.com/questions/1133857/how-accurate-is-pythons-time-sleep
+    else:
+        start = time()
+        sleep((ms + 1) / 1000.0)
+        Delay_Hook(ms, time() - start, delay_caller(sys._getframe(1)))
 
 
 def refresh_status():
@@ -300,8 +859,11 @@ def margin_all(margin_type, group_command=False):
     else:
         command_data = 0x44
 
-    for x in range(len(ADM1266_Address)):
-        status = PMBus_I2C.PMBus_Write(ADM1266_Address[x], [0x00, 0xFF])
+    if group_command == True:
+        status = PMBus_I2C.PMBus_Group_Write(ADM1266_Address, [0x00, 0xFF])
+    else:
+        for x in range(len(ADM1266_Address)):
+            status = PMBus_I2C.PMBus_Write(ADM1266_Address[x], [0x00, 0xFF])
 
     if group_command == True:
         status = PMBus_I2C.PMBus_Group_Write(ADM1266_Address, [0x01, command_data])
@@ -315,8 +877,9 @@ def margin_all(margin_type, group_command=False):
 def dac_mapping():
     dac_config_data = []
     for x in range(len(ADM1266_Address)):
+        dac_cofig_regs = PMBus_I2C.PMBus_Batch_Write_Read(ADM1266_Address[x], [([0xD5, 0x01, y], 3) for y in range(9)])
         for y in range(9):
-            dac_cofig_reg = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[x], [0xD5, 0x01, y], 3)
+            dac_cofig_reg = dac_cofig_regs[y]
             dac_cofig_reg = dac_cofig_reg[1] + (dac_cofig_reg[2] << 8)
             if (((dac_cofig_reg >> 6) & 0x1f) != 0):
                 dac_config_data.append(dac_data(ADM1266_Address[x], ((dac_cofig_reg >> 6) & 0x1f)))
@@ -381,8 +944,9 @@ def margin_single(device_address, pin_number, margin_type):
     if (pin_number == "0xFF"):
         print("Please enter a valid pin number.")
     else:
+        dac_config_regs = PMBus_I2C.PMBus_Batch_Write_Read(device_address, [([0xD5, 1, y], 3) for y in range(9)])
         for dac_index in range(9):
-            data = PMBus_I2C.PMBus_Write_Read(device_address, [0xD5, 1, dac_index], 3)
+            data = dac_config_regs[dac_index]
             data_combine = data[1] + (data[2] << 8)
             dac_mapping = (data_combine >> 6) & 0x1F
             if (dac_mapping == (pin_number + 1)):
@@ -631,19 +1195,42 @@ def Blackbox_Clear():
         read_data = PMBus_I2C.PMBus_Write(ADM1266_Address[i], write_data)
 
 
+# buffers reused by every System_Read, sized for the largest block read of 128 bytes plus the byte count
+System_Read_Command = bytearray([0xD7, 0x03, 0x80, 0x00, 0x00])
+System_Read_Buffer = bytearray(129)
+
+
 # readback system information for the device address passed. Max length = 2kbytes.
 # readback the length of the data from the "Common Data" section, and based on the data lenth, readback the remaing "System Config Data".
 # all data is stored in the System_Data list
 def System_Read(device_address):
-    write_data = [0xD7, 0x03, 0x80, 0x00, 0x00]
-    read_data = PMBus_I2C.PMBus_Write_Read(device_address, write_data, 129)
+    write_data = System_Read_Command
+    write_data[2:5] = b'\x80\x00\x00'
+    read_data = PMBus_I2C.PMBus_Write_Read_Into(device_address, write_data, System_Read_Buffer)
+    Data_length = System_Summary(read_data)
+
+    for (n, l, k) in System_Blocks(Data_length):
+        write_data[2] = n
+        write_data[3] = l
+        write_data[4] = int(k)
+
+        read_data = PMBus_I2C.PMBus_Write_Read_Into(device_address, write_data, memoryview(System_Read_Buffer)[:n + 1])
+        System_Data_Extend(read_data, n, l, k)
+
+
+# fill in the configuration name from the first block of system data and return the length of the system data
+def System_Summary(read_data):
     Data_length = read_data[1] + (read_data[2] * 256)
 
     Summary_Data[0] = "Configuration Name - '"
     Summary_Data[0] += List_to_String(read_data[30:(read_data[29] + 30)])
     Summary_Data[0] += "'"
+    return Data_length
 
-    j = 256
+
+# returns the (length, offset low byte, offset high byte) of the blocks to read back after the first block
+def System_Blocks(Data_length):
+    blocks = []
     j = 128
     while j < Data_length:
         l = j & 0xFF
@@ -651,26 +1238,25 @@ def System_Read(device_address):
         n = Data_length - j
         if n > 128:
             n = 128
-        write_data = [0xD7, 0x03, n, l, int(k)]
-
-        read_data = PMBus_I2C.PMBus_Write_Read(device_address, write_data, n + 1)
-
-        # read and add one byte of data after commonheader
-        if k == 0 and l == 128 and n == 128:
-            System_Data.extend([read_data[128]])
+        blocks.append((n, l, k))
+        j += 128
+    return blocks
 
-        else:
-            # Remove CRC byte of System Data
-            if k == 7 and l == 128 and n == 128:
-                del read_data[128]
 
-            # Remove byte count of PMBus Block Read
-            del read_data[0]
-            System_Data.extend(read_data)
+# add the data of a block read back to System_Data
+def System_Data_Extend(read_data, n, l, k):
+    # read and add one byte of data after commonheader
+    if k == 0 and l == 128 and n == 128:
+        System_Data.extend([read_data[128]])
 
-        # remove CRC byte for system data
+    else:
+        # Remove CRC byte of System Data
+        end = len(read_data)
+        if k == 7 and l == 128 and n == 128:
+            end = 128
 
-        j += 128
+        # Remove byte count of PMBus Block Read
+        System_Data.extend(read_data[1:end])
 
 
 # readback blackbox data for the device address and index provided
@@ -686,6 +1272,11 @@ def System_Parse():
     for i in range(len(ADM1266_Address)):
         System_Read(ADM1266_Address[i])
 
+    System_Data_Parse()
+
+
+# parse Rails, Signals and States from System_Data
+def System_Data_Parse():
     next_pointer = 42
     (PadData_length, PadData_pointer) = VLQ_Decode(next_pointer)
 
@@ -1092,8 +1683,9 @@ def Get_Rail_Current_Data(address, page):
     write_data = [0x00, page]
     read_data = PMBus_I2C.PMBus_Write(ADM1266_Address[address], write_data)
 
-    write_data = [0x7A]
-    read_data = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[address], write_data, 2)
+    # STATUS_VOUT, VOUT_MODE and READ_VOUT of the page
+    (status_vout, vout_mode, read_vout) = PMBus_I2C.PMBus_Batch_Write_Read(ADM1266_Address[address], [([0x7A], 2), ([0x20], 2), ([0x8B], 3)])
+    read_data = status_vout
     if page < 4:
         (VH_Data[address][page + 1][10], VH_Data[address][page + 1][11], VH_Data[address][page + 1][12],
          VH_Data[address][page + 1][13]) = VOUT_Status(read_data[0])
@@ -1103,15 +1695,13 @@ def Get_Rail_Current_Data(address, page):
          VP_Data[address][page - 3][13]) = VOUT_Status(read_data[0])
         status = VP_Status(address, page - 3)
 
-    write_data = [0x20]
-    read_data = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[address], write_data, 2)
+    read_data = vout_mode
     if page < 4:
         VH_Data[address][page + 1][8] = Exp_Calc(read_data[0])
     else:
         VP_Data[address][page - 3][8] = Exp_Calc(read_data[0])
 
-    write_data = [0x8B]
-    read_data = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[address], write_data, 3)
+    read_data = read_vout
     if page < 4:
         VH_Data[address][page + 1][9] = read_data[0] + (read_data[1] * 256)
         value = VH_Data[address][page + 1][9] * (2 ** VH_Data[address][page + 1][8])
@@ -1160,38 +1750,44 @@ def Get_Signal_Current_Data(address, index):
     return (status, name)
 
 
+# commands and preallocated read buffers for the telemetry set read back by Get_Current_Data
+Telemetry_Requests = [(b'\xE8', bytearray(52)), (b'\xE7', bytearray(18)), (b'\xE9', bytearray(3)), (b'\xEA', bytearray(3))]
+
+
 def Get_Current_Data():
     for i in range(len(ADM1266_Address)):
-        k = 1
-        write_data = [0xE8]
-        read_data = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[i], write_data, 52)
-        for j in range(1, 5, 1):
-            VH_Data[i][j][9] = read_data[k] + (read_data[k + 1] * 256)
-            VH_Data[i][j][8] = Exp_Calc(read_data[j + 34])
-            k += 2
+        # read back the complete telemetry set of the device in one batch
+        (vout_data, vout_status_data, pdio_data, gpio_data) = PMBus_I2C.PMBus_Batch_Write_Read_Into(
+            ADM1266_Address[i], Telemetry_Requests)
+        Current_Data_Parse(i, vout_data, vout_status_data, pdio_data, gpio_data)
 
-        for j in range(1, 14, 1):
-            VP_Data[i][j][9] = read_data[k] + (read_data[k + 1] * 256)
-            VP_Data[i][j][8] = Exp_Calc(read_data[j + 38])
-            k += 2
 
-        k = 1
-        write_data = [0xE7]
-        read_data = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[i], write_data, 18)
-        for j in range(1, 5, 1):
-            (VH_Data[i][j][10], VH_Data[i][j][11], VH_Data[i][j][12], VH_Data[i][j][13]) = VOUT_Status(read_data[k])
-            k += 1
-        for j in range(1, 14, 1):
-            (VP_Data[i][j][10], VP_Data[i][j][11], VP_Data[i][j][12], VP_Data[i][j][13]) = VOUT_Status(read_data[k])
-            k += 1
+# fill in the telemetry of device i from the data read back with 0xE8, 0xE7, 0xE9 and 0xEA
+def Current_Data_Parse(i, vout_data, vout_status_data, pdio_data, gpio_data):
+    k = 1
+    read_data = vout_data
+    for j in range(1, 5, 1):
+        VH_Data[i][j][9] = read_data[k] + (read_data[k + 1] * 256)
+        VH_Data[i][j][8] = Exp_Calc(read_data[j + 34])
+        k += 2
 
-        write_data = [0xE9]
-        read_data = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[i], write_data, 3)
-        PDIO_Rail_Inst_Data(read_data, i)
+    for j in range(1, 14, 1):
+        VP_Data[i][j][9] = read_data[k] + (read_data[k + 1] * 256)
+        VP_Data[i][j][8] = Exp_Calc(read_data[j + 38])
+        k += 2
 
-        write_data = [0xEA]
-        read_data = PMBus_I2C.PMBus_Write_Read(ADM1266_Address[i], write_data, 3)
-        GPIO_Signal_Inst_Data(read_data, i)
+    k = 1
+    read_data = vout_status_data
+    for j in range(1, 5, 1):
+        (VH_Data[i][j][10], VH_Data[i][j][11], VH_Data[i][j][12], VH_Data[i][j][13]) = VOUT_Status(read_data[k])
+        k += 1
+    for j in range(1, 14, 1):
+        (VP_Data[i][j][10], VP_Data[i][j][11], VP_Data[i][j][12], VP_Data[i][j][13]) = VOUT_Status(read_data[k])
+        k += 1
+
+    PDIO_Rail_Inst_Data(pdio_data, i)
+
+    GPIO_Signal_Inst_Data(gpio_data, i)
 
 
 def VH_Status(address, page):
@@ -1380,38 +1976,16 @@ def System_Read_Offline(system_data):
 
 
 def System_Parse_Offline(hex_file_path, system_data):
-    hex_file = open(hex_file_path, "rb")
-    if hex_file is not None:
-        for line in hex_file.readlines():
-            if line.startswith(b":00000001FF"):
-                break
-            data_len = int(line[1:3], 16)
-            cmd = int(line[3:7], 16)
-            data = [] if data_len == 0 else array('B', codecs.decode((line[9:9 + data_len * 2]), "hex_codec")).tolist()
-            if cmd is 0xD7:
-                del data[1:3]
-                system_data.append(data)
+    if os.path.exists(hex_file_path):
+        for (cmd, data, line) in hex_records.Load_Hex(hex_file_path).records_of(0xD7):
+            data = list(bytearray(data))
+            del data[1:3]
+            system_data.append(data)
 
         for i in range(len(ADM1266_Address)):
             System_Read_Offline(system_data)
 
-        next_pointer = 42
-        (PadData_length, PadData_pointer) = VLQ_Decode(next_pointer)
-
-        next_pointer = PadData_pointer + PadData_length + 1
-        (RailData_length, RailData_pointer) = VLQ_Decode(next_pointer)
-
-        next_pointer = RailData_pointer + RailData_length + 1
-        (StateData_length, StateData_pointer) = VLQ_Decode(next_pointer)
-
-        next_pointer = StateData_pointer + StateData_length + 1
-        (SignalData_length, SignalData_pointer) = VLQ_Decode(next_pointer)
-
-        Rail_Parse(RailData_length, RailData_pointer)
-
-        Signal_Parse(SignalData_length, SignalData_pointer)
-
-        State_Parse(StateData_length, StateData_pointer)
+        System_Data_Parse()
         return True
     else:
         return False
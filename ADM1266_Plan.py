@@ -0,0 +1,182 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Compiled programming plans, a configuration or firmware hex file is parsed once into the list of PMBus writes and the wait
+# after each of them. The plan is saved in Plan_Cache_Dir under the SHA-256 of the hex file, so the next time the same file
+# is programmed, on any device and in any session, the hex file is only hashed and not parsed again.
+# Example:
+#   plan = ADM1266_Plan.Load_Plan("2 Board Demo-device@40.hex")
+#   for (cmd, write_data, delay_ms) in plan.records:
+#       ...
+# Plan file format, all values little endian: the 4 byte magic 'ADMP', version (B), firmware (B), number of records (I),
+# then for every record: command code (H), delay in ms (H), data length (H), data without the command code
+
+import ADM1266_Lib
+import atomic_file
+import hex_records
+import os
+import struct
+import threading
+
+PLAN_MAGIC = b'ADMP'
+# Change when the delay table or the plan format changes, so plans compiled before are not used anymore
+PLAN_VERSION = 1
+
+Plan_Header = struct.Struct('<4sBBI')
+Record_Header = struct.Struct('<HHH')
+
+# Commands whose records are block writes at an offset, the records of one command can be coalesced
+Block_Commands = hex_records.Block_Commands
+
+# Directory of the compiled plans, None to keep the plans in memory only
+Plan_Cache_Dir = os.path.join(os.path.expanduser('~'), '.adm1266', 'plans')
+
+# (SHA-256 of the hex file, firmware flag) or (SHA-256, firmware flag, max_payload) -> Program_Plan, the plans loaded in this session
+Plans = {}
+Plans_Lock = threading.Lock()
+
+
+class Program_Plan:
+    def __init__(self, records, digest=None, firmware=False):
+        # list of (command code, write data starting with the command code, delay in ms after the record)
+        self.records = records
+        self.digest = digest
+        self.firmware = firmware
+
+    def to_bytes(self):
+        data = [Plan_Header.pack(PLAN_MAGIC, PLAN_VERSION, 1 if self.firmware else 0, len(self.records))]
+        for (cmd, write_data, delay_ms) in self.records:
+            data.append(Record_Header.pack(cmd, delay_ms, len(write_data) - 1))
+            data.append(bytes(write_data[1:]))
+        return b''.join(data)
+
+
+# Returns the Program_Plan in data, None if it is not a plan of this version.
+def Plan_From_Bytes(data, digest=None):
+    if len(data) < Plan_Header.size:
+        return None
+    (magic, version, firmware, count) = Plan_Header.unpack_from(data, 0)
+    if magic != PLAN_MAGIC or version != PLAN_VERSION:
+        return None
+    records = []
+    offset = Plan_Header.size
+    for i in range(count):
+        (cmd, delay_ms, data_len) = Record_Header.unpack_from(data, offset)
+        offset += Record_Header.size
+        write_data = bytes(bytearray([cmd & 0xFF])) + data[offset:offset + data_len]
+        offset += data_len
+        records.append((cmd, write_data, delay_ms))
+    return Program_Plan(records, digest, firmware == 1)
+
+
+# Configuration records get the delay of ADM1266_Lib.record_delay, firmware records 3000 ms for the first and 10 ms for the others.
+def Record_Delay(cmd, write_data, index, firmware):
+    if firmware:
+        return 3000 if index == 0 else 10
+    return ADM1266_Lib.record_delay(cmd, bytearray(write_data[1:]))
+
+
+# Parse the records of the hex file up to the end of file record.
+def Compile_Hex(file, firmware=False, digest=None):
+    records = []
+    for (cmd, data, line) in hex_records.Load_Hex(file).records():
+        write_data = bytes(bytearray([cmd & 0xFF])) + data
+        records.append((cmd, write_data, Record_Delay(cmd, write_data, len(records), firmware)))
+    return Program_Plan(records, digest, firmware)
+
+
+# Returns the offset of a block write record: command code, byte count, offset (2 bytes, little endian), data.
+# None if the record is not a block write at an offset, e.g. the 0xD6 record which erases the sequence memory.
+def Block_Offset(cmd, write_data):
+    return hex_records.block_offset(cmd, write_data[1:])
+
+
+# Returns the block write records for data at offset, a record never crosses a multiple of max_payload, see
+# hex_records.split_block.
+def Split_Block(cmd, offset, data, max_payload):
+    return [(cmd, bytes(bytearray([cmd & 0xFF])) + fields) for fields in hex_records.split_block(offset, data, max_payload)]
+
+
+# Merge consecutive block write records of the same command whose offsets follow each other, and split the data again into
+# records of max_payload bytes. The other records are kept as they are. The delays of the new records are taken again from
+# the delay table, so fewer records also means fewer delays.
+def Coalesce_Records(records, max_payload, firmware=False):
+    coalesced = []
+    # [command code, offset, data] of the block records merged so far
+    run = None
+    for record in list(records) + [None]:
+        offset = None if record is None else Block_Offset(record[0], record[1])
+        if run is not None and offset is not None and record[0] == run[0] and offset == run[1] + len(run[2]):
+            run[2].extend(bytearray(record[1][4:]))
+            continue
+        if run is not None:
+            for (cmd, write_data) in Split_Block(run[0], run[1], run[2], max_payload):
+                coalesced.append((cmd, write_data, Record_Delay(cmd, write_data, len(coalesced), firmware)))
+            run = None
+        if offset is not None:
+            run = [record[0], offset, bytearray(record[1][4:])]
+        elif record is not None:
+            coalesced.append((record[0], record[1], Record_Delay(record[0], record[1], len(coalesced), firmware)))
+    return coalesced
+
+
+def File_Digest(file):
+    return hex_records.Load_Hex(file).digest()
+
+
+def Plan_File(digest, firmware):
+    return os.path.join(Plan_Cache_Dir, '{0}.{1}.plan'.format(digest, 'firmware' if firmware else 'config'))
+
+
+# Returns the Program_Plan of the hex file, from memory, from Plan_Cache_Dir or compiled and saved to Plan_Cache_Dir.
+# With max_payload set the block write records are coalesced to records of up to max_payload data bytes, see Coalesce_Records.
+def Load_Plan(file, firmware=False, max_payload=None):
+    digest = File_Digest(file)
+    plan = Load_Digest_Plan(file, digest, firmware)
+    if max_payload is None:
+        return plan
+
+    with Plans_Lock:
+        coalesced = Plans.get((digest, firmware, max_payload))
+    if coalesced is None:
+        coalesced = Program_Plan(Coalesce_Records(plan.records, max_payload, firmware), digest, firmware)
+        with Plans_Lock:
+            Plans[(digest, firmware, max_payload)] = coalesced
+    return coalesced
+
+
+def Load_Digest_Plan(file, digest, firmware):
+    with Plans_Lock:
+        plan = Plans.get((digest, firmware))
+    if plan is not None:
+        return plan
+
+    plan = None
+    if Plan_Cache_Dir is not None and os.path.exists(Plan_File(digest, firmware)):
+        with open(Plan_File(digest, firmware), "rb") as plan_file:
+            plan = Plan_From_Bytes(plan_file.read(), digest)
+    if plan is None:
+        plan = Compile_Hex(file, firmware, digest)
+        if Plan_Cache_Dir is not None:
+            Save_Plan(plan)
+
+    with Plans_Lock:
+        Plans[(digest, firmware)] = plan
+    return plan
+
+
+# Write the plan to Plan_Cache_Dir, see atomic_file.
+def Save_Plan(plan):
+    try:
+        if not os.path.isdir(Plan_Cache_Dir):
+            os.makedirs(Plan_Cache_Dir)
+        with atomic_file.atomic_file(Plan_File(plan.digest, plan.firmware), "wb") as plan_file:
+            plan_file.write(plan.to_bytes())
+    except (IOError, OSError):
+        # the plan cache is only an optimization, programming goes on with the plan in memory
+        pass
@@ -0,0 +1,303 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Software model of the ADM1266 PMBus interface and a transport to use it in place of a dongle.
+# Example:
+#   sim = ADM1266_Sim.Sim_Transport(latency_ms=0.5)
+#   sim.add_device(0x40, ADM1266_Sim.ADM1266_Sim(config_file="2 Board Demo-device@40.hex"))
+#   PMBus_I2C.Set_Transport(sim)
+
+import PMBus_I2C
+import ADM1266_Lib
+import hex_records
+import time
+from array import array
+
+# Number of bytes (excluding byte count) returned by the block reads of the model
+IC_DEVICE_ID_LENGTH = 3
+IC_DEVICE_REV_LENGTH = 8
+BLACKBOX_RECORD_LENGTH = 64
+BLACKBOX_MAX_RECORDS = 32
+NUM_PAGES = 17
+
+# Size of the memory behind each offset addressed block command
+BLOCK_MEMORY_SIZE = {0xD6: 0x4000, 0xD7: 0x800, 0xE0: 0x800, 0xE3: 0x800, 0xFC: 0x10000}
+
+
+# busy_fraction models the time the device needs to write its flash, as a fraction of the time in the program_hex delay table.
+# While busy the device does not acknowledge any transaction.
+class ADM1266_Sim:
+    def __init__(self, ic_id=0x42, firmware_rev=(1, 14, 3), bootloader_rev=(1, 0, 2), config_file=None, busy_fraction=0.0):
+        self.ic_id = ic_id
+        self.firmware_rev = list(firmware_rev)
+        self.bootloader_rev = list(bootloader_rev)
+        self.locked = True
+        self.unlock_count = 0
+        self.in_iap = False
+        self.sequence_paused = False
+        self.refresh_until = 0
+        self.crc_status = 0
+        self.page = 0
+        self.main_memory = True
+        self.blocks = {}
+        for cmd in BLOCK_MEMORY_SIZE:
+            self.blocks[cmd] = bytearray(b'\xff' * BLOCK_MEMORY_SIZE[cmd])
+        self.registers = {}
+        self.dac_config = [0x0000] * 9
+        self.dac_code = [[0, 0] for k in range(9)]
+        self.vout_mode = [0x14] * NUM_PAGES
+        self.vout_mantissa = [0] * NUM_PAGES
+        self.vout_status = [0] * NUM_PAGES
+        self.pdio_status = 0
+        self.gpio_status = 0
+        self.blackbox = []
+        self.blackbox_index = 0
+        self.transactions = 0
+        self.busy_fraction = busy_fraction
+        self.busy_until = 0
+        self.iap_records = 0
+        if config_file is not None:
+            self.load_hex(config_file)
+
+    # Load a configuration hex file directly into the model, the same way program_hex writes it to a device.
+    def load_hex(self, file):
+        for (cmd, data, line) in hex_records.Load_Hex(file).records():
+            if cmd != 0xD8:
+                self.write([cmd] + list(bytearray(data)))
+                self.busy_until = 0
+        self.page = 0
+
+    # Set the telemetry of a rail, page 0-3 are VH1-VH4 and 4-16 are VP1-VP13.
+    def set_rail(self, page, voltage, status=0):
+        exp = self.vout_mode[page]
+        exp = exp if exp < 16 else exp - 32
+        self.vout_mantissa[page] = int(voltage / (2 ** exp)) & 0xFFFF
+        self.vout_status[page] = status
+
+    def add_blackbox_record(self, data):
+        assert len(data) == BLACKBOX_RECORD_LENGTH
+        if len(self.blackbox) < BLACKBOX_MAX_RECORDS:
+            self.blackbox.append(bytearray(data))
+        else:
+            self.blackbox[self.blackbox_index] = bytearray(data)
+        self.blackbox_index = (self.blackbox_index + 1) % BLACKBOX_MAX_RECORDS
+
+    def refresh_running(self):
+        return time.time() < self.refresh_until
+
+    def status_mfr_specific(self):
+        status = 0
+        if self.locked:
+            status |= 0x04
+        if self.refresh_running():
+            status |= 0x08
+        return status
+
+    def pages(self):
+        return range(NUM_PAGES) if self.page == 0xFF else [self.page]
+
+    def busy(self):
+        return time.time() < self.busy_until
+
+    # Start the busy time of a record written to flash, the same records program_hex and program_firmware_hex wait for.
+    def start_busy(self, cmd, data):
+        if self.busy_fraction <= 0:
+            return
+        if cmd == 0xFC and self.in_iap:
+            busy_ms = 3000 if self.iap_records == 0 else 10
+            self.iap_records += 1
+        elif cmd in (0xD6, 0xD7, 0xE0, 0xE3) and len(data) >= 4:
+            busy_ms = ADM1266_Lib.record_delay(cmd, data[1:])
+        elif cmd in (0x15, 0xF8):
+            busy_ms = ADM1266_Lib.record_delay(cmd, data[1:])
+        else:
+            return
+        self.busy_until = time.time() + busy_ms * self.busy_fraction / 1000.0
+
+    # Handle a write transaction, returns False if the device would NACK it.
+    def write(self, data):
+        self.transactions += 1
+        if self.busy():
+            return False
+        if len(data) == 0:
+            return True
+        cmd = data[0]
+        self.start_busy(cmd, data)
+
+        if cmd == 0x00:
+            self.page = data[1]
+        elif cmd == 0xFD:
+            if len(data) == 19 and data[18] == 0x02:
+                self.unlock_count += 1
+                if self.unlock_count >= 2:
+                    self.locked = False
+        elif cmd == 0xD8:
+            if data[1] == 0x04:
+                self.in_iap = False
+                self.locked = True
+                self.unlock_count = 0
+                self.page = 0
+            elif data[1] in (0x03, 0x11):
+                self.sequence_paused = True
+            elif data[1] == 0x00:
+                self.sequence_paused = False
+        elif cmd == 0xF5:
+            self.refresh_until = time.time() + 10
+        elif cmd == 0xF9:
+            self.crc_status = 0
+        elif cmd == 0xFA:
+            self.main_memory = (data[2] == 0)
+        elif cmd == 0xFC and len(data) == 4 and data[1] == 2:
+            self.in_iap = True
+            self.iap_records = 0
+        elif cmd == 0xD5 and len(data) >= 5:
+            self.dac_config[data[2]] = data[3] + (data[4] << 8)
+        elif cmd == 0xEB and len(data) >= 5:
+            self.dac_code[data[2]] = [data[3], data[4]]
+        elif cmd == 0xDE:
+            if data[1:4] == [0x02, 0xFE, 0x00]:
+                self.blackbox = []
+                self.blackbox_index = 0
+        elif cmd == 0x20:
+            for page in self.pages():
+                self.vout_mode[page] = data[1]
+        elif cmd in BLOCK_MEMORY_SIZE and len(data) >= 4:
+            self.block_write(cmd, data)
+        else:
+            for page in self.pages():
+                self.registers[(page, cmd)] = list(data[1:])
+        return True
+
+    def block_write(self, cmd, data):
+        memory = self.blocks[cmd]
+        offset = data[2] | (data[3] << 8)
+        if cmd == 0xD6 and offset == 0xFFFF:
+            memory[:] = b'\xff' * len(memory)
+            return
+        if offset == 0 and cmd != 0xD6:
+            memory[:] = b'\xff' * len(memory)
+        payload = data[4:2 + data[1]]
+        memory[offset:offset + len(payload)] = bytearray(payload)
+
+    # Handle a write followed by a repeated start read, returns the bytes read back or None if the device would NACK it.
+    def write_read(self, data, read_length):
+        self.transactions += 1
+        if self.busy():
+            return None
+        cmd = data[0]
+
+        if cmd == 0xAD:
+            response = [IC_DEVICE_ID_LENGTH, self.ic_id, 0x12, 0x66]
+        elif cmd == 0xAE:
+            response = [IC_DEVICE_REV_LENGTH] + self.firmware_rev + self.bootloader_rev + [0, 0]
+        elif cmd == 0x80:
+            response = [self.status_mfr_specific()]
+        elif cmd == 0xED:
+            status = self.crc_status << 4
+            response = [status & 0xFF, status >> 8]
+        elif cmd == 0xE6:
+            # index of the most recent record followed by the number of records
+            last_index = (self.blackbox_index - 1) % BLACKBOX_MAX_RECORDS if len(self.blackbox) > 0 else 0
+            response = [4, 0, 0, last_index, len(self.blackbox)]
+        elif cmd == 0xDE:
+            index = data[2]
+            record = self.blackbox[index] if index < len(self.blackbox) else bytearray(BLACKBOX_RECORD_LENGTH)
+            response = [BLACKBOX_RECORD_LENGTH] + list(record)
+        elif cmd == 0xE7:
+            response = [NUM_PAGES] + self.vout_status
+        elif cmd == 0xE8:
+            response = [NUM_PAGES * 3]
+            for page in range(NUM_PAGES):
+                response += [self.vout_mantissa[page] & 0xFF, self.vout_mantissa[page] >> 8]
+            response += self.vout_mode
+        elif cmd == 0xE9:
+            response = [2, self.pdio_status & 0xFF, self.pdio_status >> 8]
+        elif cmd == 0xEA:
+            response = [2, self.gpio_status & 0xFF, self.gpio_status >> 8]
+        elif cmd == 0xD5:
+            dac_config = self.dac_config[data[2]]
+            response = [2, dac_config & 0xFF, dac_config >> 8]
+        elif cmd == 0x20:
+            response = [self.vout_mode[self.page % NUM_PAGES]]
+        elif cmd == 0x7A:
+            response = [self.vout_status[self.page % NUM_PAGES]]
+        elif cmd == 0x8B:
+            mantissa = self.vout_mantissa[self.page % NUM_PAGES]
+            response = [mantissa & 0xFF, mantissa >> 8]
+        elif cmd in BLOCK_MEMORY_SIZE and len(data) == 5:
+            length = data[2]
+            offset = data[3] | (data[4] << 8)
+            response = [length] + list(self.blocks[cmd][offset:offset + length])
+        else:
+            response = self.registers.get((self.page % NUM_PAGES, cmd), [])
+
+        response = list(response[:read_length])
+        response += [0xFF] * (read_length - len(response))
+        return response
+
+
+# Transport which routes the PMBus transactions to ADM1266_Sim devices instead of an I2C bus.
+# latency_ms is added to every transaction, and when bitrate_khz is set the time to clock the bytes on the bus is added as well.
+# Above max_bitrate_khz the bus is unreliable like a board with long wires or weak pull-ups: the devices do not respond.
+# max_write_length models a master which cannot write more bytes in one transaction, None if it is not known.
+class Sim_Transport(PMBus_I2C.PMBus_Transport):
+    def __init__(self, devices=None, latency_ms=0.0, bitrate_khz=None, max_bitrate_khz=None, max_write_length=None):
+        self.devices = {} if devices is None else dict(devices)
+        self.latency_ms = latency_ms
+        self.bitrate_khz = bitrate_khz
+        self.max_bitrate_khz = max_bitrate_khz
+        self.max_write_length = max_write_length
+        self.bus_timeout_ms = None
+        self.transactions = 0
+        self.errors = 0
+
+    def add_device(self, device_address, device=None):
+        if device is None:
+            device = ADM1266_Sim()
+        self.devices[device_address] = device
+        return device
+
+    def bus_delay(self, num_bytes):
+        delay_s = self.latency_ms / 1000.0
+        if self.bitrate_khz:
+            # address byte plus data bytes, 9 clocks each
+            delay_s += (num_bytes + 1) * 9 / (self.bitrate_khz * 1000.0)
+        if delay_s > 0:
+            time.sleep(delay_s)
+
+    def bus_error(self):
+        if self.max_bitrate_khz is not None and self.bitrate_khz is not None and self.bitrate_khz > self.max_bitrate_khz:
+            self.errors += 1
+            return True
+        return False
+
+    def write_read(self, device_address, write_data, read_length):
+        self.transactions += 1
+        self.bus_delay(len(write_data) + read_length + 1)
+        device = self.devices.get(device_address)
+        if device is None or self.bus_error():
+            return array('B')
+        read_data = device.write_read(list(write_data), read_length)
+        return array('B', read_data if read_data is not None else [])
+
+    def write(self, device_address, write_data, stop=True):
+        self.transactions += 1
+        self.bus_delay(len(write_data))
+        device = self.devices.get(device_address)
+        if self.max_write_length is not None and len(write_data) > self.max_write_length:
+            raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+        if device is None or self.bus_error() or not device.write(list(write_data)):
+            raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+
+    def set_bitrate(self, bitrate_khz):
+        self.bitrate_khz = bitrate_khz
+        return bitrate_khz
+
+    def set_bus_timeout(self, timeout_ms):
+        self.bus_timeout_ms = timeout_ms
+        return timeout_ms
@@ -0,0 +1,206 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# I2C bitrate tuning, the fastest bitrate at which the devices answer reliably is found once per dongle and board
+# and stored in a JSON file in ~/.adm1266, the following sessions start at that bitrate.
+# If transactions fail at the tuned bitrate, Bitrate_Fallback_Transport switches to the next slower bitrate and stores it.
+# Example:
+#   PMBus_Bitrate.Open_Tuned_Aardvark(0, [0x40, 0x42], 'Board 1')
+
+import PMBus_I2C
+import atomic_file
+import json
+import os
+
+# Bitrates tried in kHz, slowest first
+Bitrates = [100, 400, 800, 1000]
+
+# SMBus/PMBus clock low timeout is 25 - 35 ms, the bus is free again long before this
+BUS_TIMEOUT_MS = 35
+
+# Number of IC_DEVICE_ID and IC_DEVICE_REV reads per device at each bitrate
+TUNE_TRIES = 20
+
+# Bitrates of all the dongles and boards, the same file wherever the scripts are run from
+BITRATE_FILE = os.path.join(os.path.expanduser('~'), '.adm1266', 'bitrate.json')
+
+
+# Returns [IC_DEVICE_ID, IC_DEVICE_REV] of the device, empty or short arrays if it did not respond.
+def Read_Ids(transport, device_address):
+    return transport.batch_write_read(device_address, [([0xAD], 4), ([0xAE], 9)])
+
+
+def Valid_Ic_Id(ic_id):
+    return len(ic_id) == 4 and (ic_id[1] == 66 or ic_id[1] == 65) and ic_id[2] == 18 and ic_id[3] == 102
+
+
+# Returns True if all the devices return the reference IDs read at the slowest bitrate on every try.
+def Check_Bitrate(transport, device_addresses, reference, tries=TUNE_TRIES):
+    for i in range(tries):
+        for device_address in device_addresses:
+            ids = Read_Ids(transport, device_address)
+            if [list(x) for x in ids] != reference[device_address]:
+                return False
+    return True
+
+
+# Try the bitrates from slowest to fastest and select the fastest one at which all the devices answered correctly.
+# The bitrates are the ones set_bitrate returns, a dongle sets the nearest bitrate it supports, e.g. the Aardvark runs at
+# 800 kHz when 1000 kHz is asked for. Once the bitrate does not go up any more the faster bitrates are not tried.
+# Returns the bitrate selected, None if the transport cannot change its bitrate.
+def Tune_Bitrate(transport, device_addresses, bitrates=Bitrates, tries=TUNE_TRIES):
+    bitrates = sorted(bitrates)
+    selected = transport.set_bitrate(bitrates[0])
+    if selected is None:
+        return None
+    transport.set_bus_timeout(BUS_TIMEOUT_MS)
+
+    reference = {}
+    for device_address in device_addresses:
+        ids = Read_Ids(transport, device_address)
+        if not Valid_Ic_Id(ids[0]) or len(ids[1]) != 9:
+            raise Exception('Device with address ' + hex(device_address) + ' is not present at {0} kHz.'.format(selected))
+        reference[device_address] = [list(x) for x in ids]
+
+    for bitrate in bitrates[1:]:
+        actual = transport.set_bitrate(bitrate)
+        if actual <= selected or not Check_Bitrate(transport, device_addresses, reference, tries):
+            break
+        selected = actual
+    return transport.set_bitrate(selected)
+
+
+def Bitrate_Key(dongle_id, board):
+    return '{0}/{1}'.format(dongle_id, board)
+
+
+def Load_Bitrates(file=None):
+    file = BITRATE_FILE if file is None else file
+    if not os.path.exists(file):
+        return {}
+    with open(file, 'r') as json_file:
+        return json.load(json_file)
+
+
+# The file is written through a temporary file, see atomic_file, so an interrupted save keeps the bitrates stored before.
+def Save_Bitrate(dongle_id, board, bitrate_khz, file=None):
+    file = BITRATE_FILE if file is None else file
+    bitrates = Load_Bitrates(file)
+    bitrates[Bitrate_Key(dongle_id, board)] = bitrate_khz
+    directory = os.path.dirname(os.path.abspath(file))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with atomic_file.atomic_file(file, 'w') as json_file:
+        json.dump(bitrates, json_file, indent=2, sort_keys=True)
+
+
+# Switches to the next slower bitrate when a transaction fails because of the bitrate.
+# After a failure IC_DEVICE_ID is read back, if it is correct the failure was not caused by the bitrate and nothing changes.
+# Otherwise the fastest slower bitrate at which IC_DEVICE_ID reads back correctly is selected, failed reads are then repeated once,
+# failed writes still raise their exception as the device may have received part of the data.
+# on_change(bitrate_khz) is called whenever the bitrate is lowered.
+class Bitrate_Fallback_Transport(PMBus_I2C.Transport_Wrapper):
+    def __init__(self, transport, bitrate_khz, bitrates=Bitrates, on_change=None):
+        PMBus_I2C.Transport_Wrapper.__init__(self, transport)
+        self.bitrates = sorted(bitrates)
+        self.bitrate_khz = bitrate_khz
+        self.on_change = on_change
+        self.fallbacks = 0
+
+    # Returns True if the bitrate was lowered.
+    def fall_back(self, device_address):
+        if Valid_Ic_Id(self.transport.write_read(device_address, [0xAD], 4)):
+            return False
+        for bitrate in reversed([x for x in self.bitrates if x < self.bitrate_khz]):
+            bitrate = self.transport.set_bitrate(bitrate)
+            if bitrate >= self.bitrate_khz:
+                continue
+            if Valid_Ic_Id(self.transport.write_read(device_address, [0xAD], 4)):
+                self.bitrate_khz = bitrate
+                self.fallbacks += 1
+                print('Bus errors, I2C bitrate lowered to {0} kHz.'.format(bitrate))
+                if self.on_change is not None:
+                    self.on_change(bitrate)
+                return True
+        # the device does not respond at any bitrate, e.g. it is not present
+        self.transport.set_bitrate(self.bitrate_khz)
+        return False
+
+    def write_read(self, device_address, write_data, read_length):
+        read_data = self.transport.write_read(device_address, write_data, read_length)
+        if len(read_data) != read_length and self.fall_back(device_address):
+            read_data = self.transport.write_read(device_address, write_data, read_length)
+        return read_data
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        read_data = self.transport.write_read_into(device_address, write_data, read_buffer)
+        if len(read_data) != len(read_buffer) and self.fall_back(device_address):
+            read_data = self.transport.write_read_into(device_address, write_data, read_buffer)
+        return read_data
+
+    def batch_write_read(self, device_address, requests):
+        results = self.transport.batch_write_read(device_address, requests)
+        failed = [i for i in range(len(requests)) if len(results[i]) != requests[i][1]]
+        if len(failed) > 0 and self.fall_back(device_address):
+            for i in failed:
+                results[i] = self.transport.write_read(device_address, requests[i][0], requests[i][1])
+        return results
+
+    def batch_write_read_into(self, device_address, requests):
+        results = self.transport.batch_write_read_into(device_address, requests)
+        failed = [i for i in range(len(requests)) if len(results[i]) != len(requests[i][1])]
+        if len(failed) > 0 and self.fall_back(device_address):
+            for i in failed:
+                results[i] = self.transport.write_read_into(device_address, requests[i][0], requests[i][1])
+        return results
+
+    def write(self, device_address, write_data, stop=True):
+        try:
+            self.transport.write(device_address, write_data, stop)
+        except Exception:
+            self.fall_back(device_address)
+            raise
+
+    def group_write(self, device_addresses, write_data):
+        try:
+            self.transport.group_write(device_addresses, write_data)
+        except Exception:
+            for device_address in device_addresses:
+                self.fall_back(device_address)
+            raise
+
+
+# Set up the bitrate of the transport for the board, the bitrate stored for the dongle and board is used if there is one,
+# otherwise the bitrate is tuned and stored. Returns the Bitrate_Fallback_Transport wrapping the transport.
+def Tuned_Transport(transport, device_addresses, board=None, file=None, retune=False):
+    dongle_id = getattr(transport, 'dongle_id', None)
+    if board is None:
+        board = ','.join('0x{0:02X}'.format(x) for x in device_addresses)
+    bitrate = None if retune else Load_Bitrates(file).get(Bitrate_Key(dongle_id, board))
+    if bitrate is not None:
+        bitrate = transport.set_bitrate(bitrate)
+        if bitrate is None:
+            return transport
+        transport.set_bus_timeout(BUS_TIMEOUT_MS)
+    else:
+        bitrate = Tune_Bitrate(transport, device_addresses)
+        if bitrate is None:
+            return transport
+        Save_Bitrate(dongle_id, board, bitrate, file)
+    print('I2C bitrate: {0} kHz'.format(bitrate))
+
+    def on_change(bitrate_khz):
+        Save_Bitrate(dongle_id, board, bitrate_khz, file)
+
+    return Bitrate_Fallback_Transport(transport, bitrate, on_change=on_change)
+
+
+# Open_Aardvark with the bitrate tuned for the board and automatic fallback to slower bitrates.
+def Open_Tuned_Aardvark(number=0, device_addresses=[0x40], board=None, file=None, retune=False):
+    PMBus_I2C.Open_Aardvark(number)
+    PMBus_I2C.Set_Transport(Tuned_Transport(PMBus_I2C.Get_Transport(), device_addresses, board, file, retune))
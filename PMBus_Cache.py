@@ -0,0 +1,194 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Read cache for PMBus registers which do not change during a session, e.g. IC_DEVICE_ID, IC_DEVICE_REV, VOUT_MODE or the DAC configuration.
+# Reads are cached per (device address, command, page, argument bytes, read length) based on the policy of the command:
+#   STATIC   - cached until invalidated explicitly or the device is reset, e.g. IC_DEVICE_ID
+#   SESSION  - cached until the register is written, the memory is refreshed or the session is ended with end_session()
+#   VOLATILE - never cached, e.g. telemetry and status
+# Example:
+#   PMBus_Cache.Enable_Cache()
+
+import PMBus_I2C
+import threading
+from array import array
+
+STATIC = 'static'
+SESSION = 'session'
+VOLATILE = 'volatile'
+
+Default_Policies = {
+    0xAD: STATIC,   # IC_DEVICE_ID
+    0xAE: STATIC,   # IC_DEVICE_REV
+    0x20: SESSION,  # VOUT_MODE
+    0x21: SESSION,  # VOUT_COMMAND
+    0x25: SESSION,  # VOUT_MARGIN_HIGH
+    0x26: SESSION,  # VOUT_MARGIN_LOW
+    0xD5: SESSION,  # DAC configuration
+    0xD6: SESSION,  # sequence configuration
+    0xD7: SESSION,  # system data
+    0xE0: SESSION,  # logic configuration
+    0xE3: SESSION,  # user data
+}
+
+# Commands whose value depends on the PAGE selected
+Paged_Commands = set([0x01, 0x20, 0x21, 0x25, 0x26, 0x7A, 0x8B])
+
+# Writes which reset the device, the same set as PMBus_Page
+Reset_Commands = PMBus_I2C.Reset_Commands
+
+
+class Cache_Transport(PMBus_I2C.Transport_Wrapper):
+    def __init__(self, transport, policies=None):
+        PMBus_I2C.Transport_Wrapper.__init__(self, transport)
+        self.policies = dict(Default_Policies)
+        if policies is not None:
+            self.policies.update(policies)
+        self.cache = {}
+        # last PAGE written per device address, None if not known
+        self.page = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def policy(self, command):
+        return self.policies.get(command, VOLATILE)
+
+    def key(self, device_address, write_data, read_length):
+        command = write_data[0]
+        if self.policy(command) == VOLATILE:
+            return None
+        page = None
+        if command in Paged_Commands:
+            page = self.page.get(device_address)
+            if page is None or page == 0xFF:
+                return None
+        return (device_address, command, page, bytes(bytearray(write_data[1:])), read_length)
+
+    def lookup(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return data
+
+    def store(self, key, read_data, read_length):
+        # failed or short reads are not cached
+        if key is not None and len(read_data) == read_length:
+            with self.lock:
+                self.cache[key] = bytes(bytearray(read_data))
+
+    def write_read(self, device_address, write_data, read_length):
+        key = self.key(device_address, write_data, read_length)
+        data = self.lookup(key)
+        if data is not None:
+            return array('B', data)
+        read_data = self.transport.write_read(device_address, write_data, read_length)
+        self.store(key, read_data, read_length)
+        return read_data
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        key = self.key(device_address, write_data, len(read_buffer))
+        data = self.lookup(key)
+        view = memoryview(read_buffer)
+        if data is not None:
+            view[:len(data)] = data
+            return view[:len(data)]
+        read_data = self.transport.write_read_into(device_address, write_data, read_buffer)
+        self.store(key, read_data, len(read_buffer))
+        return read_data
+
+    def batch_write_read(self, device_address, requests):
+        results = [None] * len(requests)
+        misses = []
+        for i in range(len(requests)):
+            (write_data, read_length) = requests[i]
+            key = self.key(device_address, write_data, read_length)
+            data = self.lookup(key)
+            if data is not None:
+                results[i] = array('B', data)
+            else:
+                misses.append((i, key))
+        if len(misses) > 0:
+            read_data = self.transport.batch_write_read(device_address, [requests[i] for (i, key) in misses])
+            for ((i, key), data) in zip(misses, read_data):
+                self.store(key, data, requests[i][1])
+                results[i] = data
+        return results
+
+    def batch_write_read_into(self, device_address, requests):
+        results = [None] * len(requests)
+        misses = []
+        for i in range(len(requests)):
+            (write_data, read_buffer) = requests[i]
+            key = self.key(device_address, write_data, len(read_buffer))
+            data = self.lookup(key)
+            if data is not None:
+                view = memoryview(read_buffer)
+                view[:len(data)] = data
+                results[i] = view[:len(data)]
+            else:
+                misses.append((i, key))
+        if len(misses) > 0:
+            read_data = self.transport.batch_write_read_into(device_address, [requests[i] for (i, key) in misses])
+            for ((i, key), data) in zip(misses, read_data):
+                self.store(key, data, len(requests[i][1]))
+                results[i] = data
+        return results
+
+    def write(self, device_address, write_data, stop=True):
+        self.written(device_address, write_data)
+        self.transport.write(device_address, write_data, stop)
+
+    def group_write(self, device_addresses, write_data):
+        for device_address in device_addresses:
+            self.written(device_address, write_data)
+        self.transport.group_write(device_addresses, write_data)
+
+    # Drop what a write to the device makes stale. This is done before the write, so a failed write cannot leave stale data.
+    # After a reset, see PMBus_I2C.Reset_Commands, everything cached for the device is dropped, STATIC registers as well.
+    def written(self, device_address, write_data):
+        command = write_data[0]
+        self.page[device_address] = PMBus_I2C.Page_After_Write(self.page.get(device_address), write_data)
+        if PMBus_I2C.Is_Reset(write_data):
+            self.invalidate(device_address)
+        elif command != 0x00 and command != 0xD8:
+            self.invalidate(device_address, command)
+
+    # Drop the cached reads of a device and command, of all commands of the device if command is None, or of all devices.
+    def invalidate(self, device_address=None, command=None):
+        with self.lock:
+            for key in list(self.cache):
+                if (device_address is None or key[0] == device_address) and (command is None or key[1] == command):
+                    del self.cache[key]
+
+    # Drop all the SESSION reads, STATIC reads are kept.
+    def end_session(self):
+        with self.lock:
+            for key in list(self.cache):
+                if self.policy(key[1]) != STATIC:
+                    del self.cache[key]
+
+
+# Wrap the selected transport with a cache and select it, returns the Cache_Transport.
+def Enable_Cache(policies=None):
+    transport = PMBus_I2C.Get_Transport()
+    if not isinstance(transport, Cache_Transport):
+        transport = Cache_Transport(transport, policies)
+        PMBus_I2C.Set_Transport(transport)
+    return transport
+
+
+def Disable_Cache():
+    transport = PMBus_I2C.Get_Transport()
+    if isinstance(transport, Cache_Transport):
+        PMBus_I2C.Set_Transport(transport.transport)
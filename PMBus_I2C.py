@@ -1,50 +1,291 @@
-import aardvark_py
+try:
+    import aardvark_py
+except ImportError:
+    # The Aardvark driver is only required when a dongle is used, other transports work without it.
+    aardvark_py = None
 from array import array
+import threading
 
 Aardvark_Handle = 0
 
-# Modify 'def PMBus_Write_Read' to replace with your own drivers.
+# Transport used by PMBus_Write_Read, PMBus_Write and PMBus_Group_Write.
+# Open_Aardvark selects the Aardvark transport, Set_Transport selects any other transport e.g. ADM1266_Sim.Sim_Transport.
+Transport = None
+
+# A thread can select its own transport with Set_Thread_Transport, which then takes precedence over Transport in that thread.
+Thread_Transport = threading.local()
+
+
+# Base class of all PMBus transports.
+# To use a different I2C dongle or master, derive from this class, implement write_read and write and pass an instance to Set_Transport.
+class PMBus_Transport(object):
+
+    # Write write_data to the device followed by a repeated start and a read of read_length bytes.
+    # Returns an array('B') with the data read back, a short or empty array if the device did not respond.
+    def write_read(self, device_address, write_data, read_length):
+        raise NotImplementedError()
+
+    # Same as write_read, but the data is read into read_buffer (bytearray, array('B') or writable memoryview)
+    # and a memoryview of the bytes read is returned, so no new buffer is allocated for the transaction.
+    # Transports override this to read straight into the buffer, the default copies the result of write_read.
+    def write_read_into(self, device_address, write_data, read_buffer):
+        read_data = self.write_read(device_address, write_data, len(read_buffer))
+        view = memoryview(read_buffer)
+        view[:len(read_data)] = array('B', read_data)
+        return view[:len(read_data)]
+
+    # Write write_data to the device, raise an exception if the device did not acknowledge all bytes.
+    def write(self, device_address, write_data, stop=True):
+        raise NotImplementedError()
+
+    # Run several write_read transactions on the same device, requests is a list of (write_data, read_length).
+    # Transports which can send several transactions at once override this, the default sends them one by one.
+    def batch_write_read(self, device_address, requests):
+        return [self.write_read(device_address, write_data, read_length) for (write_data, read_length) in requests]
+
+    # Same as batch_write_read with requests as a list of (write_data, read_buffer), returns a memoryview for each request.
+    def batch_write_read_into(self, device_address, requests):
+        return [self.write_read_into(device_address, write_data, read_buffer) for (write_data, read_buffer) in requests]
+
+    # PMBus group command, write_data is written to every device with a repeated start in between and a single stop at the end,
+    # so all the devices execute the command at the same time.
+    def group_write(self, device_addresses, write_data):
+        for x in range(len(device_addresses)):
+            self.write(device_addresses[x], write_data, x == len(device_addresses) - 1)
+
+    # Set the I2C bitrate in kHz, returns the bitrate actually set or None if the transport cannot change it.
+    def set_bitrate(self, bitrate_khz):
+        return None
+
+    # Set the time in ms after which a transaction is abandoned if the bus stays busy, returns the timeout set or None.
+    def set_bus_timeout(self, timeout_ms):
+        return None
+
+    def close(self):
+        pass
+
+
+# Writes to these commands can change the PAGE and any other register of the device: memory refresh, memory select,
+# firmware update and RESTORE_USER_ALL. A system reset (0xD8 0x04) does the same. Used by the wrappers which keep track of
+# the PAGE or of register values, PMBus_Cache and PMBus_Page.
+Reset_Commands = set([0xF5, 0xFA, 0xFC, 0x16])
+
+
+def Is_Reset(write_data):
+    command = write_data[0]
+    return command in Reset_Commands or (command == 0xD8 and len(write_data) > 1 and write_data[1] == 0x04)
+
+
+# Returns True if the PAGE of the device is not known any more once write_data is sent: a PAGE write or a reset.
+def Changes_Page(write_data):
+    return write_data[0] == 0x00 or Is_Reset(write_data)
+
+
+# Returns the PAGE of the device after write_data was written to it, page is the PAGE before, None if it is not known.
+def Page_After_Write(page, write_data):
+    if not Changes_Page(write_data):
+        return page
+    if write_data[0] == 0x00 and len(write_data) == 2:
+        return write_data[1]
+    return None
+
+
+# Base class for transports which add a feature, e.g. caching, on top of another transport and pass the transactions on to it.
+# Attributes which are not defined by the wrapper, e.g. dongle_id, are looked up in the wrapped transport.
+class Transport_Wrapper(PMBus_Transport):
+    def __init__(self, transport):
+        self.transport = transport
+
+    def __getattr__(self, name):
+        if name == 'transport':
+            raise AttributeError(name)
+        return getattr(self.transport, name)
+
+    def write_read(self, device_address, write_data, read_length):
+        return self.transport.write_read(device_address, write_data, read_length)
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        return self.transport.write_read_into(device_address, write_data, read_buffer)
+
+    def write(self, device_address, write_data, stop=True):
+        self.transport.write(device_address, write_data, stop)
+
+    def batch_write_read(self, device_address, requests):
+        return self.transport.batch_write_read(device_address, requests)
+
+    def batch_write_read_into(self, device_address, requests):
+        return self.transport.batch_write_read_into(device_address, requests)
+
+    def group_write(self, device_addresses, write_data):
+        self.transport.group_write(device_addresses, write_data)
+
+    def set_bitrate(self, bitrate_khz):
+        return self.transport.set_bitrate(bitrate_khz)
+
+    def set_bus_timeout(self, timeout_ms):
+        return self.transport.set_bus_timeout(timeout_ms)
+
+    def close(self):
+        self.transport.close()
+
+
+# Size of the buffers preallocated by the transports, larger than the longest PMBus block transaction
+BUFFER_SIZE = 512
+
+
+class Aardvark_Transport(PMBus_Transport):
+    def __init__(self, handle, dongle_id=None):
+        self.handle = handle
+        self.dongle_id = dongle_id
+        # None until set_bitrate is called, the dongle starts at 100 kHz
+        self.bitrate_khz = None
+        # longest write which fits in the write buffer, see ADM1266_Lib.block_payload
+        self.max_write_length = BUFFER_SIZE
+        self.write_buffer = array('B', bytes(BUFFER_SIZE))
+        self.read_buffer = array('B', bytes(BUFFER_SIZE))
+
+    # The Aardvark API only takes array('B'), other bytes-like data is copied into the preallocated write buffer.
+    def out_data(self, write_data):
+        if isinstance(write_data, array) and write_data.typecode == 'B':
+            return write_data
+        if isinstance(write_data, list):
+            return array('B', write_data)
+        memoryview(self.write_buffer)[:len(write_data)] = write_data
+        return (self.write_buffer, len(write_data))
+
+    def write_read(self, device_address, write_data, read_length):
+        status = aardvark_py.aa_i2c_write_read(self.handle, device_address, aardvark_py.AA_I2C_NO_FLAGS, self.out_data(write_data), read_length)
+        return status[2]
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        read_length = len(read_buffer)
+        if isinstance(read_buffer, array) and read_buffer.typecode == 'B':
+            in_data = read_buffer
+        else:
+            in_data = self.read_buffer
+        status = aardvark_py.aa_i2c_write_read(self.handle, device_address, aardvark_py.AA_I2C_NO_FLAGS, self.out_data(write_data), (in_data, read_length))
+        num_read = max(0, min(status[3], read_length))
+        view = memoryview(read_buffer)
+        if in_data is not read_buffer:
+            view[:num_read] = memoryview(in_data)[:num_read]
+        return view[:num_read]
+
+    def write(self, device_address, write_data, stop=True):
+        flags = aardvark_py.AA_I2C_NO_FLAGS if stop else aardvark_py.AA_I2C_NO_STOP
+        num = aardvark_py.aa_i2c_write(self.handle, device_address, flags, self.out_data(write_data))
+
+        if num != len(write_data):
+            raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+
+    # Only the write to the last device ends with a stop, if a device does not acknowledge the stop is sent right away.
+    def group_write(self, device_addresses, write_data):
+        a = self.out_data(write_data)
+
+        for x in range(len(device_addresses)):
+            device_address = device_addresses[x]
+            if (x < len(device_addresses) - 1):
+                num = aardvark_py.aa_i2c_write(self.handle, device_address, aardvark_py.AA_I2C_NO_STOP, a)
+            else:
+                num = aardvark_py.aa_i2c_write(self.handle, device_address, aardvark_py.AA_I2C_NO_FLAGS, a)
+
+            if num != len(write_data):
+                if (x < len(device_addresses) - 1):
+                    aardvark_py.aa_i2c_free_bus(self.handle)
+                raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+
+    def set_bitrate(self, bitrate_khz):
+        bitrate = aardvark_py.aa_i2c_bitrate(self.handle, bitrate_khz)
+        if bitrate < 0:
+            raise Exception('Failed to set bitrate of dongle {0}: {1}'.format(self.dongle_id, aardvark_py.aa_status_string(bitrate)))
+        self.bitrate_khz = bitrate
+        return bitrate
+
+    def set_bus_timeout(self, timeout_ms):
+        timeout = aardvark_py.aa_i2c_bus_timeout(self.handle, timeout_ms)
+        if timeout < 0:
+            raise Exception('Failed to set bus timeout of dongle {0}: {1}'.format(self.dongle_id, aardvark_py.aa_status_string(timeout)))
+        return timeout
+
+    def close(self):
+        aardvark_py.aa_close(self.handle)
+
+
+# Select the transport used for all the following PMBus transactions.
+def Set_Transport(transport):
+    global Transport
+    Transport = transport
+
+
+# Select the transport used by the PMBus transactions of the calling thread only, pass None to use Transport again.
+def Set_Thread_Transport(transport):
+    Thread_Transport.transport = transport
+
+
+def Get_Transport():
+    transport = getattr(Thread_Transport, 'transport', None)
+    if transport is None:
+        transport = Transport
+    if transport is None:
+        raise Exception('No PMBus transport selected, call Open_Aardvark or Set_Transport first.')
+    return transport
+
+
 def PMBus_Write_Read(device_address, write_data, read_length):
-    a = array('B')
-    for i in write_data:
-        a.append(i)
-    status = aardvark_py.aa_i2c_write_read(Aardvark_Handle, device_address, aardvark_py.AA_I2C_NO_FLAGS, a, read_length)
-    return status[2]
+    return Get_Transport().write_read(device_address, write_data, read_length)
+
+
+# write_data can be a list or any bytes-like object. The data is read into read_buffer and a memoryview of the bytes read is returned.
+# Reusing the same read_buffer for every call avoids allocating a new buffer for each transaction.
+def PMBus_Write_Read_Into(device_address, write_data, read_buffer):
+    return Get_Transport().write_read_into(device_address, write_data, read_buffer)
+
+
+# Returns a list with the data read back for each (write_data, read_length) in requests.
+def PMBus_Batch_Write_Read(device_address, requests):
+    return Get_Transport().batch_write_read(device_address, requests)
+
+
+# Returns a list with a memoryview of the data read back into read_buffer for each (write_data, read_buffer) in requests.
+def PMBus_Batch_Write_Read_Into(device_address, requests):
+    return Get_Transport().batch_write_read_into(device_address, requests)
+
 
-# Modify 'def PMBus_Write' to replace with your own drivers.
 # By default stop condtion will be set, if stop condtion is not required then pass stop as False
 def PMBus_Write(device_address, write_data, stop = True):
-    a = array('B')
-    for i in write_data:
-        a.append(i)
-    
-    num = aardvark_py.aa_i2c_write(Aardvark_Handle, device_address, aardvark_py.AA_I2C_NO_FLAGS, a)
-       
-    if num != len(write_data):
-        raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+    Get_Transport().write(device_address, write_data, stop)
 
 
+# Send write_data to all the devices in one group command, with a single device it is a normal write.
 def PMBus_Group_Write(ADM1266_Address, write_data):
-    a = array('B')
-    for i in write_data:
-        a.append(i)
-    
-    for x in range(len(ADM1266_Address)):
-        device_address = ADM1266_Address[x]
-        if (x < len(ADM1266_Address)):
-            num = aardvark_py.aa_i2c_write(Aardvark_Handle, device_address, aardvark_py.AA_I2C_NO_STOP, a)
-        else:
-            num = aardvark_py.aa_i2c_write(Aardvark_Handle, device_address, aardvark_py.AA_I2C_NO_FLAGS, a)
+    if len(ADM1266_Address) == 1:
+        Get_Transport().write(ADM1266_Address[0], write_data)
+    else:
+        Get_Transport().group_write(ADM1266_Address, write_data)
 
-    if num != len(write_data):
-        raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+
+# Returns a list of (port, unique_id) of all the Aardvark dongles connected, ports in use by another program are flagged with AA_PORT_NOT_FREE.
+def Find_Aardvarks():
+    if aardvark_py is None:
+        raise Exception('Aardvark driver (aardvark_py) could not be loaded.')
+    (num, ports, unique_ids) = aardvark_py.aa_find_devices_ext(16, 16)
+    return [(ports[i], unique_ids[i]) for i in range(min(num, len(ports)))]
+
+
+# Open the dongle on the port and return its transport, without selecting it.
+def Open_Aardvark_Transport(port, dongle_id):
+    handle = aardvark_py.aa_open(port)
+    if (handle <= 0):
+        raise Exception('Failed to open dongle: ' + str(dongle_id))
+    return Aardvark_Transport(handle, dongle_id)
 
 
 # function to establish a connection with the Aardvark dongle
 def Open_Aardvark(number = 0):
     global Aardvark_Handle
+    if aardvark_py is None:
+        raise Exception('Aardvark driver (aardvark_py) could not be loaded.')
     (num, ports, unique_ids) = aardvark_py.aa_find_devices_ext(16, 16)
-    port = None    
+    port = None
     dongle_id = number
     if number == 0 and len(unique_ids) > 0:
         port = ports[0]
@@ -55,17 +296,20 @@ def Open_Aardvark(number = 0):
                 port = ports[i]
                 dongle_id = unique_ids[i]
                 break
-    
+
     if port is None:
         raise Exception('Failed to find dongle: ' + str(dongle_id))
     Aardvark_Handle = aardvark_py.aa_open(port)
     if (Aardvark_Handle <= 0):
         raise Exception('Failed to open dongle: ' + str(dongle_id))
     else:
+        Set_Transport(Aardvark_Transport(Aardvark_Handle, dongle_id))
         print('Using dongle with ID: ' + str(dongle_id) + "\n")
 
-        
+
 
 # function to close the connection with the Aardvark dongle
 def Close_Aardvark():
-    aardvark_py.aa_close(Aardvark_Handle)
+    if Transport is not None:
+        Transport.close()
+    Set_Transport(None)
@@ -0,0 +1,173 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# PMBus transport for a native I2C/SMBus controller on Linux (/dev/i2c-N).
+# All transactions are issued with the I2C_RDWR ioctl, a write followed by a read is one combined transaction with a repeated start.
+# Transactions can be queued and are then sent with as few ioctl calls as possible, e.g.
+#   bus = PMBus_I2C_Linux.I2C_Dev_Transport(1)
+#   PMBus_I2C.Set_Transport(bus)
+# The longest write depends on the controller, pass it as max_write_length to let program_hex merge the block write records of
+# the hex files up to that size, see ADM1266_Lib.block_payload.
+# For testing without a controller pass a replacement for fcntl.ioctl, or load the kernel i2c-stub module.
+
+import PMBus_I2C
+import ctypes
+import os
+from array import array
+
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+# Maximum number of messages the kernel accepts in one I2C_RDWR call
+I2C_RDWR_IOCTL_MAX_MSGS = 42
+
+
+class i2c_msg(ctypes.Structure):
+    _fields_ = [('addr', ctypes.c_uint16),
+                ('flags', ctypes.c_uint16),
+                ('len', ctypes.c_uint16),
+                ('buf', ctypes.POINTER(ctypes.c_uint8))]
+
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [('msgs', ctypes.POINTER(i2c_msg)),
+                ('nmsgs', ctypes.c_uint32)]
+
+
+class I2C_Dev_Transport(PMBus_I2C.PMBus_Transport):
+    def __init__(self, bus, ioctl=None, fd=None, max_write_length=None):
+        if ioctl is None:
+            import fcntl
+            ioctl = fcntl.ioctl
+        self.ioctl = ioctl
+        self.device_name = bus if isinstance(bus, str) else '/dev/i2c-{0}'.format(bus)
+        self.fd = os.open(self.device_name, os.O_RDWR) if fd is None else fd
+        self.max_write_length = max_write_length
+        # queued transactions, each one is (messages, as_view) where messages is a list of (device_address, write_data, read_buffer)
+        self.queue = []
+
+    # Queue a write followed by a repeated start read, the result is returned by flush.
+    # If read_buffer is given the data is read into it and flush returns a memoryview, otherwise a new array('B') is returned.
+    def queue_write_read(self, device_address, write_data, read_length, read_buffer=None):
+        as_view = read_buffer is not None
+        if read_buffer is None:
+            read_buffer = array('B', bytes(read_length))
+        self.queue.append(([(device_address, write_data, None), (device_address, None, read_buffer)], as_view))
+        return len(self.queue) - 1
+
+    # Queue a write, flush returns True if it was sent and False if it failed.
+    def queue_write(self, device_address, write_data):
+        self.queue.append(([(device_address, write_data, None)], False))
+        return len(self.queue) - 1
+
+    # Send all queued transactions, packing as many as possible into each ioctl call.
+    # Returns a list with the data read back for every queued transaction, True or False for writes.
+    # If a call fails, it is not known which of its transactions were done. Only the reads are repeated one by one, so only
+    # the failing read returns an empty result. The writes of the call are not sent again and return False.
+    def flush(self):
+        queue = self.queue
+        self.queue = []
+        results = []
+        batch = []
+        num_msgs = 0
+        for transaction in queue:
+            if num_msgs + len(transaction[0]) > I2C_RDWR_IOCTL_MAX_MSGS:
+                results += self.transfer_batch(batch)
+                batch = []
+                num_msgs = 0
+            batch.append(transaction)
+            num_msgs += len(transaction[0])
+        if len(batch) > 0:
+            results += self.transfer_batch(batch)
+        return results
+
+    def transfer_batch(self, batch):
+        try:
+            self.transfer([message for (messages, as_view) in batch for message in messages])
+            return [self.result(transaction, True) for transaction in batch]
+        except (IOError, OSError):
+            if len(batch) == 1:
+                return [self.result(batch[0], False)]
+        results = []
+        for transaction in batch:
+            if transaction[0][-1][2] is None:
+                results.append(self.result(transaction, False))
+                continue
+            try:
+                self.transfer(transaction[0])
+                results.append(self.result(transaction, True))
+            except (IOError, OSError):
+                results.append(self.result(transaction, False))
+        return results
+
+    def result(self, transaction, ok):
+        (messages, as_view) = transaction
+        read_buffer = messages[-1][2]
+        if read_buffer is None:
+            return ok
+        if as_view:
+            return memoryview(read_buffer)[:len(read_buffer) if ok else 0]
+        return read_buffer if ok else array('B')
+
+    # Send the messages with a single I2C_RDWR ioctl call, the read messages are filled in place.
+    def transfer(self, messages):
+        msgs = (i2c_msg * len(messages))()
+        buffers = []
+        for i in range(len(messages)):
+            (device_address, write_data, read_buffer) = messages[i]
+            if read_buffer is None:
+                buf = (ctypes.c_uint8 * len(write_data)).from_buffer_copy(bytearray(write_data) if isinstance(write_data, list) else write_data)
+                msgs[i].flags = 0
+            else:
+                buf = (ctypes.c_uint8 * len(read_buffer)).from_buffer(read_buffer)
+                msgs[i].flags = I2C_M_RD
+            msgs[i].addr = device_address
+            msgs[i].len = len(buf)
+            msgs[i].buf = ctypes.cast(buf, ctypes.POINTER(ctypes.c_uint8))
+            buffers.append(buf)
+
+        ioctl_data = i2c_rdwr_ioctl_data(msgs, len(messages))
+        self.ioctl(self.fd, I2C_RDWR, ioctl_data)
+
+    def write_read(self, device_address, write_data, read_length):
+        self.queue_write_read(device_address, write_data, read_length)
+        return self.flush()[-1]
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        self.queue_write_read(device_address, write_data, len(read_buffer), read_buffer)
+        return self.flush()[-1]
+
+    def write(self, device_address, write_data, stop=True):
+        try:
+            self.transfer([(device_address, write_data, None)])
+        except (IOError, OSError):
+            raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+
+    def batch_write_read(self, device_address, requests):
+        for (write_data, read_length) in requests:
+            self.queue_write_read(device_address, write_data, read_length)
+        return self.flush()[-len(requests):] if len(requests) > 0 else []
+
+    def batch_write_read_into(self, device_address, requests):
+        for (write_data, read_buffer) in requests:
+            self.queue_write_read(device_address, write_data, len(read_buffer), read_buffer)
+        return self.flush()[-len(requests):] if len(requests) > 0 else []
+
+    # All the writes are sent in one I2C_RDWR call, so there is a repeated start between the devices and a single stop at the end.
+    def group_write(self, device_addresses, write_data):
+        if len(device_addresses) > I2C_RDWR_IOCTL_MAX_MSGS:
+            raise Exception('Group command is limited to {0} devices.'.format(I2C_RDWR_IOCTL_MAX_MSGS))
+        try:
+            self.transfer([(device_address, write_data, None) for device_address in device_addresses])
+        except (IOError, OSError):
+            raise Exception('Failed to write group command to i2c devices ' +
+                            ', '.join('@{0:02X}'.format(x) for x in device_addresses) + '.')
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,146 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# PAGE (0x00) shadowing, the PAGE selected on every device is remembered and a PAGE write which would not change it is not sent.
+# The shadow of a device is cleared when it is reset, its memory is refreshed or selected, or a transaction with it fails,
+# the next PAGE write is then always sent.
+# Paged_Batch_Write_Read groups paged reads by device and page, so every page is selected only once.
+# Example:
+#   PMBus_Page.Enable_Page_Shadow()
+#   results = PMBus_Page.Paged_Batch_Write_Read([(0x40, page, [0x8B], 3) for page in range(17)])
+
+import PMBus_I2C
+import threading
+
+# Writes which can change the PAGE of the device besides a PAGE write, the same set as PMBus_Cache
+Reset_Commands = PMBus_I2C.Reset_Commands
+
+
+class Page_Shadow_Transport(PMBus_I2C.Transport_Wrapper):
+    def __init__(self, transport):
+        PMBus_I2C.Transport_Wrapper.__init__(self, transport)
+        # device address -> PAGE selected, an address which is not in the dict has an unknown PAGE
+        self.page = {}
+        self.lock = threading.Lock()
+        self.skipped = 0
+
+    def forget(self, device_address=None):
+        with self.lock:
+            if device_address is None:
+                self.page = {}
+            else:
+                self.page.pop(device_address, None)
+
+    def write(self, device_address, write_data, stop=True):
+        if write_data[0] == 0x00 and len(write_data) == 2 and stop:
+            with self.lock:
+                if self.page.get(device_address) == write_data[1]:
+                    self.skipped += 1
+                    return
+        self.written(device_address, write_data)
+        try:
+            self.transport.write(device_address, write_data, stop)
+        except Exception:
+            self.forget(device_address)
+            raise
+        self.page_written(device_address, write_data)
+
+    def group_write(self, device_addresses, write_data):
+        for device_address in device_addresses:
+            self.written(device_address, write_data)
+        try:
+            self.transport.group_write(device_addresses, write_data)
+        except Exception:
+            for device_address in device_addresses:
+                self.forget(device_address)
+            raise
+        for device_address in device_addresses:
+            self.page_written(device_address, write_data)
+
+    # Clear the shadow before a write which changes the PAGE, see PMBus_I2C.Changes_Page, it is set again once a PAGE write
+    # succeeded.
+    def written(self, device_address, write_data):
+        if PMBus_I2C.Changes_Page(write_data):
+            self.forget(device_address)
+
+    def page_written(self, device_address, write_data):
+        page = PMBus_I2C.Page_After_Write(None, write_data)
+        if page is not None:
+            with self.lock:
+                self.page[device_address] = page
+
+    def read(self, device_address, write_data, read_data, read_length):
+        if len(read_data) != read_length:
+            self.forget(device_address)
+        elif write_data[0] == 0x00 and len(write_data) == 1:
+            with self.lock:
+                self.page[device_address] = read_data[0]
+
+    def write_read(self, device_address, write_data, read_length):
+        read_data = self.transport.write_read(device_address, write_data, read_length)
+        self.read(device_address, write_data, read_data, read_length)
+        return read_data
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        read_data = self.transport.write_read_into(device_address, write_data, read_buffer)
+        self.read(device_address, write_data, read_data, len(read_buffer))
+        return read_data
+
+    def batch_write_read(self, device_address, requests):
+        results = self.transport.batch_write_read(device_address, requests)
+        for ((write_data, read_length), read_data) in zip(requests, results):
+            self.read(device_address, write_data, read_data, read_length)
+        return results
+
+    def batch_write_read_into(self, device_address, requests):
+        results = self.transport.batch_write_read_into(device_address, requests)
+        for ((write_data, read_buffer), read_data) in zip(requests, results):
+            self.read(device_address, write_data, read_data, len(read_buffer))
+        return results
+
+
+# Wrap the selected transport with a PAGE shadow and select it, returns the Page_Shadow_Transport.
+def Enable_Page_Shadow():
+    transport = PMBus_I2C.Get_Transport()
+    if not isinstance(transport, Page_Shadow_Transport):
+        transport = Page_Shadow_Transport(transport)
+        PMBus_I2C.Set_Transport(transport)
+    return transport
+
+
+def Disable_Page_Shadow():
+    transport = PMBus_I2C.Get_Transport()
+    if isinstance(transport, Page_Shadow_Transport):
+        PMBus_I2C.Set_Transport(transport.transport)
+
+
+# Group operations by device and page, operations is a list whose items start with (device_address, page, ...).
+# Returns a list of ((device_address, page), indexes of the operations on that page), in the order each page first
+# appears in operations. The operations on the same page keep their order.
+def Group_By_Page(operations):
+    groups = {}
+    order = []
+    for i in range(len(operations)):
+        key = (operations[i][0], operations[i][1])
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(i)
+    return [(key, groups[key]) for key in order]
+
+
+# Run paged reads with one PAGE write per device and page, requests is a list of (device_address, page, write_data, read_length).
+# Returns the data read back for every request in the order of requests.
+def Paged_Batch_Write_Read(requests):
+    results = [None] * len(requests)
+    for ((device_address, page), indexes) in Group_By_Page(requests):
+        PMBus_I2C.PMBus_Write(device_address, [0x00, page])
+        read_data = PMBus_I2C.PMBus_Batch_Write_Read(device_address, [(requests[i][2], requests[i][3]) for i in indexes])
+        for (i, data) in zip(indexes, read_data):
+            results[i] = data
+    return results
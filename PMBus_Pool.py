@@ -0,0 +1,118 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Pool of PMBus buses, e.g. one Aardvark dongle per board, which runs work on all the buses at the same time.
+# Every bus is served by its own worker thread, so the transactions on one bus stay in order while the buses run in parallel.
+# Inside a worker the PMBus_I2C functions (and so all of ADM1266_Lib) use the transport of that bus.
+# Functions of ADM1266_Lib which work on the global ADM1266_Lib.ADM1266_Address list or the parsed system data are not thread safe,
+# use the functions which take a device address, e.g. program_hex, get_firmware_rev, all_crc_status or Indexed_Blackbox_Data.
+# Example:
+#   pool = PMBus_Pool.PMBus_Pool()
+#   pool.open_aardvarks({1845957160: [0x40, 0x42], 1845957180: [0x40, 0x42]})
+#   firmware_revs = pool.run_per_device(ADM1266_Lib.get_firmware_rev)
+#   pool.close()
+
+import PMBus_I2C
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PMBus_Pool:
+    def __init__(self):
+        # bus id (e.g. the unique ID of the dongle) -> transport
+        self.buses = {}
+        # bus id -> list of device addresses on that bus
+        self.addresses = {}
+        # bus id -> exception raised by the last run on that bus
+        self.errors = {}
+
+    def add_bus(self, bus_id, transport, device_addresses=None):
+        self.buses[bus_id] = transport
+        self.addresses[bus_id] = list(device_addresses) if device_addresses is not None else []
+
+    # Bind a group of device addresses to a bus.
+    def bind(self, bus_id, device_addresses):
+        if bus_id not in self.buses:
+            raise Exception('Bus ' + str(bus_id) + ' is not in the pool.')
+        self.addresses[bus_id] = list(device_addresses)
+
+    # Open Aardvark dongles and add them to the pool.
+    # dongles can be None to open every free dongle found, a list of unique IDs, or a dict of unique ID -> device addresses.
+    # device_addresses is bound to every dongle which does not have its own address list.
+    def open_aardvarks(self, dongles=None, device_addresses=None):
+        found = PMBus_I2C.Find_Aardvarks()
+        if dongles is None:
+            dongles = [unique_id for (port, unique_id) in found if not (port & PMBus_I2C.aardvark_py.AA_PORT_NOT_FREE)]
+        if not isinstance(dongles, dict):
+            dongles = dict((dongle_id, device_addresses) for dongle_id in dongles)
+
+        ports = dict((unique_id, port) for (port, unique_id) in found)
+        for dongle_id in dongles:
+            if dongle_id not in ports:
+                raise Exception('Failed to find dongle: ' + str(dongle_id))
+            if ports[dongle_id] & PMBus_I2C.aardvark_py.AA_PORT_NOT_FREE:
+                raise Exception('Dongle ' + str(dongle_id) + ' is in use.')
+
+        for dongle_id in dongles:
+            transport = PMBus_I2C.Open_Aardvark_Transport(ports[dongle_id], dongle_id)
+            addresses = dongles[dongle_id] if dongles[dongle_id] is not None else device_addresses
+            self.add_bus(dongle_id, transport, addresses)
+            print('Using dongle with ID: ' + str(dongle_id))
+        return list(dongles)
+
+    # Returns a list of (bus id, device address) of all the devices in the pool.
+    def devices(self):
+        return [(bus_id, device_address) for bus_id in self.buses for device_address in self.addresses[bus_id]]
+
+    def run_on_bus(self, bus_id, function, *args):
+        PMBus_I2C.Set_Thread_Transport(self.buses[bus_id])
+        try:
+            return function(*args)
+        finally:
+            PMBus_I2C.Set_Thread_Transport(None)
+
+    # Call function(bus_id, device_addresses, *args) for every bus, all buses at the same time.
+    # Returns a dict of bus id -> result. If the function raised an exception on any bus, the other buses still
+    # complete and an exception is raised at the end, unless raise_errors is False, then the failures are left in self.errors.
+    def run(self, function, *args, **kwargs):
+        raise_errors = kwargs.pop('raise_errors', True)
+        results = {}
+        self.errors = {}
+        if len(self.buses) == 0:
+            return results
+        with ThreadPoolExecutor(max_workers=len(self.buses)) as executor:
+            futures = {}
+            for bus_id in self.buses:
+                futures[bus_id] = executor.submit(self.run_on_bus, bus_id, function, bus_id, self.addresses[bus_id], *args)
+            for bus_id in futures:
+                try:
+                    results[bus_id] = futures[bus_id].result()
+                except Exception as e:
+                    self.errors[bus_id] = e
+
+        if raise_errors and len(self.errors) > 0:
+            raise Exception('Failed on bus ' + ', '.join(str(bus_id) + ': ' + str(self.errors[bus_id]) for bus_id in self.errors))
+        return results
+
+    # Call function(device_address, *args) for every device. The devices of one bus are done one after the other,
+    # the buses at the same time. Returns a dict of (bus id, device address) -> result.
+    def run_per_device(self, function, *args, **kwargs):
+        def run_devices(bus_id, device_addresses):
+            return [function(device_address, *args) for device_address in device_addresses]
+
+        bus_results = self.run(run_devices, **kwargs)
+        results = {}
+        for bus_id in bus_results:
+            for (device_address, result) in zip(self.addresses[bus_id], bus_results[bus_id]):
+                results[(bus_id, device_address)] = result
+        return results
+
+    def close(self):
+        for bus_id in self.buses:
+            self.buses[bus_id].close()
+        self.buses = {}
+        self.addresses = {}
@@ -0,0 +1,207 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Bus instrumentation, records per device address and command code the number of transactions, the bytes written and read,
+# the errors and a histogram of the transaction latency. The time spent in ADM1266_Lib.delay is recorded separately
+# per programming operation, e.g. program_hex, or else per calling function, so the time on the bus can be compared with the
+# fixed waits, see ADM1266_Lib.operation.
+# Example:
+#   stats = PMBus_Stats.Enable_Stats()
+#   ADM1266_Lib.program_configration()
+#   stats.write_json('stats.json')
+#   stats.write_csv('stats.csv')
+
+import PMBus_I2C
+import ADM1266_Lib
+import threading
+import json
+import csv
+import time
+
+if hasattr(time, 'perf_counter'):
+    clock = time.perf_counter
+else:
+    clock = time.time
+
+# Upper bounds of the latency histogram buckets in ms, the last bucket holds everything above
+Latency_Buckets = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100]
+
+
+class Command_Stats:
+    def __init__(self):
+        self.count = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(Latency_Buckets) + 1)
+
+    def add(self, bytes_written, bytes_read, ms, error):
+        self.count += 1
+        self.bytes_written += bytes_written
+        self.bytes_read += bytes_read
+        if error:
+            self.errors += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        bucket = 0
+        while bucket < len(Latency_Buckets) and ms > Latency_Buckets[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def to_dict(self):
+        return {'count': self.count, 'bytes_written': self.bytes_written, 'bytes_read': self.bytes_read, 'errors': self.errors,
+                'total_ms': self.total_ms, 'max_ms': self.max_ms, 'histogram': list(self.histogram)}
+
+
+class Delay_Stats:
+    def __init__(self):
+        self.count = 0
+        self.requested_ms = 0.0
+        self.total_ms = 0.0
+
+    def to_dict(self):
+        return {'count': self.count, 'requested_ms': self.requested_ms, 'total_ms': self.total_ms}
+
+
+class Stats_Transport(PMBus_I2C.Transport_Wrapper):
+    def __init__(self, transport):
+        PMBus_I2C.Transport_Wrapper.__init__(self, transport)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # (device address, command code) -> Command_Stats
+            self.commands = {}
+            # name of the function which called delay -> Delay_Stats
+            self.delays = {}
+
+    def record(self, device_address, write_data, bytes_read, ms, error):
+        key = (device_address, write_data[0] if len(write_data) > 0 else None)
+        with self.lock:
+            if key not in self.commands:
+                self.commands[key] = Command_Stats()
+            self.commands[key].add(len(write_data), bytes_read, ms, error)
+
+    def record_delay(self, ms, seconds, caller):
+        with self.lock:
+            if caller not in self.delays:
+                self.delays[caller] = Delay_Stats()
+            self.delays[caller].count += 1
+            self.delays[caller].requested_ms += ms
+            self.delays[caller].total_ms += seconds * 1000.0
+
+    def write_read(self, device_address, write_data, read_length):
+        start = clock()
+        read_data = self.transport.write_read(device_address, write_data, read_length)
+        self.record(device_address, write_data, len(read_data), (clock() - start) * 1000.0, len(read_data) != read_length)
+        return read_data
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        start = clock()
+        read_data = self.transport.write_read_into(device_address, write_data, read_buffer)
+        self.record(device_address, write_data, len(read_data), (clock() - start) * 1000.0, len(read_data) != len(read_buffer))
+        return read_data
+
+    # The time of a batch is shared equally between its transactions.
+    def batch_write_read(self, device_address, requests):
+        start = clock()
+        results = self.transport.batch_write_read(device_address, requests)
+        ms = (clock() - start) * 1000.0 / max(1, len(requests))
+        for ((write_data, read_length), read_data) in zip(requests, results):
+            self.record(device_address, write_data, len(read_data), ms, len(read_data) != read_length)
+        return results
+
+    def batch_write_read_into(self, device_address, requests):
+        start = clock()
+        results = self.transport.batch_write_read_into(device_address, requests)
+        ms = (clock() - start) * 1000.0 / max(1, len(requests))
+        for ((write_data, read_buffer), read_data) in zip(requests, results):
+            self.record(device_address, write_data, len(read_data), ms, len(read_data) != len(read_buffer))
+        return results
+
+    def write(self, device_address, write_data, stop=True):
+        start = clock()
+        try:
+            self.transport.write(device_address, write_data, stop)
+        except Exception:
+            self.record(device_address, write_data, 0, (clock() - start) * 1000.0, True)
+            raise
+        self.record(device_address, write_data, 0, (clock() - start) * 1000.0, False)
+
+    def group_write(self, device_addresses, write_data):
+        start = clock()
+        error = False
+        try:
+            self.transport.group_write(device_addresses, write_data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            ms = (clock() - start) * 1000.0 / max(1, len(device_addresses))
+            for device_address in device_addresses:
+                self.record(device_address, write_data, 0, ms, error)
+
+    # Returns the time on the bus and the time in delay, both in ms.
+    def totals(self):
+        with self.lock:
+            return (sum(stats.total_ms for stats in self.commands.values()), sum(stats.total_ms for stats in self.delays.values()))
+
+    def to_dict(self):
+        with self.lock:
+            commands = []
+            for (device_address, command) in sorted(self.commands, key=lambda key: (key[0], -1 if key[1] is None else key[1])):
+                entry = {'address': device_address, 'command': command}
+                entry.update(self.commands[(device_address, command)].to_dict())
+                commands.append(entry)
+            delays = []
+            for caller in sorted(self.delays):
+                entry = {'function': caller}
+                entry.update(self.delays[caller].to_dict())
+                delays.append(entry)
+        return {'latency_buckets_ms': Latency_Buckets, 'commands': commands, 'delays': delays}
+
+    def write_json(self, file):
+        with open(file, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+    # One row per device address and command, then one row per function which called delay.
+    def write_csv(self, file):
+        data = self.to_dict()
+        bucket_names = ['<={0}ms'.format(bound) for bound in Latency_Buckets] + ['>{0}ms'.format(Latency_Buckets[-1])]
+        with open(file, 'w') as csv_file:
+            writer = csv.writer(csv_file, lineterminator='\n')
+            writer.writerow(['type', 'address', 'command', 'function', 'count', 'bytes_written', 'bytes_read', 'errors',
+                             'total_ms', 'max_ms'] + bucket_names)
+            for entry in data['commands']:
+                writer.writerow(['bus', '0x{0:02X}'.format(entry['address']),
+                                 '' if entry['command'] is None else '0x{0:02X}'.format(entry['command']), '',
+                                 entry['count'], entry['bytes_written'], entry['bytes_read'], entry['errors'],
+                                 round(entry['total_ms'], 3), round(entry['max_ms'], 3)] + entry['histogram'])
+            for entry in data['delays']:
+                writer.writerow(['delay', '', '', entry['function'], entry['count'], '', '', '',
+                                 round(entry['total_ms'], 3), ''] + [''] * len(bucket_names))
+
+
+# Wrap the selected transport with a Stats_Transport, select it and record the delays, returns the Stats_Transport.
+def Enable_Stats():
+    transport = PMBus_I2C.Get_Transport()
+    if not isinstance(transport, Stats_Transport):
+        transport = Stats_Transport(transport)
+        PMBus_I2C.Set_Transport(transport)
+    ADM1266_Lib.Delay_Hook = transport.record_delay
+    return transport
+
+
+def Disable_Stats():
+    transport = PMBus_I2C.Get_Transport()
+    if isinstance(transport, Stats_Transport):
+        PMBus_I2C.Set_Transport(transport.transport)
+    ADM1266_Lib.Delay_Hook = None
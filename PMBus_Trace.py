@@ -0,0 +1,210 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Record the PMBus traffic to a binary trace file and replay it without hardware.
+# A session, e.g. a Blackbox Read or Telemetry Read, is recorded once on the board and can then be replayed any number of times
+# to run or benchmark the parsers of ADM1266_Lib offline with real data.
+# Example:
+#   PMBus_Trace.Start_Recording('telemetry.trace')
+#   ADM1266_Lib.System_Parse()
+#   ADM1266_Lib.Get_Current_Data()
+#   PMBus_Trace.Stop_Recording()
+#   ...
+#   PMBus_I2C.Set_Transport(PMBus_Trace.Replay_Transport('telemetry.trace'))
+# Trace file format, all values little endian: the 4 byte magic 'PMBT' and a version byte, then one record per transaction
+#   kind (B), status (B), device address (B), time since the start of the recording in s (d), write length (H),
+#   read length requested (H), read length (H), write data, data read back
+# A group command is recorded as one write record per device.
+
+import PMBus_I2C
+import struct
+import threading
+import time
+from array import array
+
+TRACE_MAGIC = b'PMBT'
+TRACE_VERSION = 1
+
+WRITE_READ = 0
+WRITE = 1
+WRITE_NO_STOP = 2
+
+STATUS_OK = 0
+# the device did not acknowledge, the write raised an exception or the read returned fewer bytes than requested
+STATUS_ERROR = 1
+
+Record_Header = struct.Struct('<BBBdHHH')
+
+
+class Trace_Record:
+    def __init__(self, kind, status, device_address, timestamp, write_data, read_data, read_length=None):
+        self.kind = kind
+        self.status = status
+        self.device_address = device_address
+        self.timestamp = timestamp
+        self.write_data = bytes(write_data)
+        self.read_data = bytes(read_data)
+        # number of bytes requested, more than len(read_data) if the read failed
+        self.read_length = len(read_data) if read_length is None else read_length
+
+
+# Returns a list of Trace_Record with all the transactions in the trace file.
+def Read_Trace(file):
+    with open(file, 'rb') as trace_file:
+        data = trace_file.read()
+    if data[:4] != TRACE_MAGIC:
+        raise Exception('{0} is not a PMBus trace file.'.format(file))
+    if data[4] != TRACE_VERSION:
+        raise Exception('Unsupported PMBus trace version {0}.'.format(data[4]))
+    records = []
+    offset = 5
+    while offset + Record_Header.size <= len(data):
+        (kind, status, device_address, timestamp, write_length, read_length, num_read) = Record_Header.unpack_from(data, offset)
+        offset += Record_Header.size
+        write_data = data[offset:offset + write_length]
+        offset += write_length
+        read_data = data[offset:offset + num_read]
+        offset += num_read
+        records.append(Trace_Record(kind, status, device_address, timestamp, write_data, read_data, read_length))
+    return records
+
+
+class Record_Transport(PMBus_I2C.Transport_Wrapper):
+    def __init__(self, transport, file):
+        PMBus_I2C.Transport_Wrapper.__init__(self, transport)
+        self.trace_file = open(file, 'wb')
+        self.trace_file.write(TRACE_MAGIC + bytes(bytearray([TRACE_VERSION])))
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def record(self, kind, device_address, write_data, read_data, read_length=0, status=STATUS_OK):
+        write_data = bytes(bytearray(write_data))
+        read_data = bytes(bytearray(read_data))
+        if len(read_data) != read_length:
+            status = STATUS_ERROR
+        with self.lock:
+            if self.trace_file is None:
+                return
+            self.trace_file.write(Record_Header.pack(kind, status, device_address, time.time() - self.start, len(write_data),
+                                                     read_length, len(read_data)))
+            self.trace_file.write(write_data)
+            self.trace_file.write(read_data)
+
+    def write_read(self, device_address, write_data, read_length):
+        read_data = self.transport.write_read(device_address, write_data, read_length)
+        self.record(WRITE_READ, device_address, write_data, read_data, read_length)
+        return read_data
+
+    def write_read_into(self, device_address, write_data, read_buffer):
+        read_data = self.transport.write_read_into(device_address, write_data, read_buffer)
+        self.record(WRITE_READ, device_address, write_data, read_data, len(read_buffer))
+        return read_data
+
+    def batch_write_read(self, device_address, requests):
+        results = self.transport.batch_write_read(device_address, requests)
+        for ((write_data, read_length), read_data) in zip(requests, results):
+            self.record(WRITE_READ, device_address, write_data, read_data, read_length)
+        return results
+
+    def batch_write_read_into(self, device_address, requests):
+        results = self.transport.batch_write_read_into(device_address, requests)
+        for ((write_data, read_buffer), read_data) in zip(requests, results):
+            self.record(WRITE_READ, device_address, write_data, read_data, len(read_buffer))
+        return results
+
+    def write(self, device_address, write_data, stop=True):
+        kind = WRITE if stop else WRITE_NO_STOP
+        try:
+            self.transport.write(device_address, write_data, stop)
+        except Exception:
+            self.record(kind, device_address, write_data, [], status=STATUS_ERROR)
+            raise
+        self.record(kind, device_address, write_data, [])
+
+    def group_write(self, device_addresses, write_data):
+        status = STATUS_ERROR
+        try:
+            self.transport.group_write(device_addresses, write_data)
+            status = STATUS_OK
+        finally:
+            for device_address in device_addresses:
+                self.record(WRITE, device_address, write_data, [], status=status)
+
+    # Close the trace file, the transactions are still passed on to the transport.
+    def stop(self):
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+                self.trace_file = None
+
+    def close(self):
+        self.stop()
+        self.transport.close()
+
+
+# Answers the transactions from a trace file.
+# The transactions are expected in the order they were recorded, the replay is then exactly the recorded session.
+# If strict is False and a transaction is not the next one in the trace, the last recorded answer to the same
+# transaction is returned instead, so a parser which reads in a different order can still run against the trace.
+# With loop set the replay starts over at the end of the trace, e.g. to run the same session many times.
+class Replay_Transport(PMBus_I2C.PMBus_Transport):
+    def __init__(self, file, strict=True, loop=False):
+        self.records = Read_Trace(file) if not isinstance(file, list) else file
+        self.strict = strict
+        self.loop = loop
+        self.position = 0
+        self.answers = {}
+        for record in self.records:
+            self.answers[(record.kind, record.device_address, record.write_data, record.read_length)] = record
+
+    def rewind(self):
+        self.position = 0
+
+    def next_record(self, kind, device_address, write_data, read_length):
+        write_data = bytes(bytearray(write_data))
+        if self.position >= len(self.records) and self.loop:
+            self.position = 0
+        if self.position < len(self.records):
+            record = self.records[self.position]
+            if (record.kind == kind and record.device_address == device_address and record.write_data == write_data and
+                    (kind != WRITE_READ or record.read_length == read_length)):
+                self.position += 1
+                return record
+        if not self.strict:
+            record = self.answers.get((kind, device_address, write_data, read_length if kind == WRITE_READ else 0))
+            if record is not None:
+                return record
+        raise Exception('Transaction with i2c device @{0:02X} [{1}] is not in the trace at record {2}.'.format(
+            device_address, ' '.join('{0:02X}'.format(x) for x in bytearray(write_data)), self.position))
+
+    def write_read(self, device_address, write_data, read_length):
+        record = self.next_record(WRITE_READ, device_address, write_data, read_length)
+        return array('B', record.read_data)
+
+    def write(self, device_address, write_data, stop=True):
+        record = self.next_record(WRITE if stop else WRITE_NO_STOP, device_address, write_data, 0)
+        if record.status != STATUS_OK:
+            raise Exception('Failed to write i2c device @{0:02X}.'.format(device_address))
+
+    def group_write(self, device_addresses, write_data):
+        for device_address in device_addresses:
+            self.write(device_address, write_data)
+
+
+# Record all the transactions of the selected transport to file, returns the Record_Transport.
+def Start_Recording(file):
+    transport = Record_Transport(PMBus_I2C.Get_Transport(), file)
+    PMBus_I2C.Set_Transport(transport)
+    return transport
+
+
+def Stop_Recording():
+    transport = PMBus_I2C.Get_Transport()
+    if isinstance(transport, Record_Transport):
+        transport.stop()
+        PMBus_I2C.Set_Transport(transport.transport)
@@ -0,0 +1,44 @@
+# Copyright (c) 2017-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Files which are written through a temporary file in the same directory and then renamed, so another process or thread
+# never reads a partly written file, it sees the old file or the new one. Used for the compiled plans, the journals, the
+# tuned bitrates and the files of hex_file_chopper.
+# Example:
+#   with atomic_file.atomic_file("device.plan", "wb") as plan_file:
+#       plan_file.write(data)
+
+import os
+import threading
+
+
+# Returns the name of the temporary file, unique for the process and thread writing it.
+def temp_file_name(file):
+    return '{0}.{1}.{2}.tmp'.format(file, os.getpid(), threading.current_thread().ident)
+
+
+# Context manager which opens the temporary file of file with mode. When the block completes the temporary file replaces
+# file, when it raises the temporary file is removed and file stays as it was.
+class atomic_file:
+    def __init__(self, file, mode='wb'):
+        self.file = file
+        self.mode = mode
+        self.temp_file = temp_file_name(file)
+        self.output = None
+
+    def __enter__(self):
+        self.output = open(self.temp_file, self.mode)
+        return self.output
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.output.close()
+        if exc_type is None:
+            os.replace(self.temp_file, self.file)
+        elif os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+        return False
@@ -6,186 +6,265 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
-import sys
-from array import array
-import codecs
+# Split the block write records of a firmware or configuration hex file into records of a smaller size, for I2C masters
+# which cannot write the 128 byte records of the files from the ADI tools.
+# The hex file is read one record at a time and the new records are written as soon as they are full, so the time taken
+# grows linearly with the file and only one record of every block is held in memory.
+# chunk_records returns the new records without writing a file, e.g. to program them directly.
+# Batch mode chops many files to several sizes in a pool of worker processes and writes a JSON manifest with the SHA-256 of
+# every new file. The files are written through temporary files, so a file is either complete or not there.
+# Example:
+#   python hex_file_chopper.py adm1266_v1.14.3.hex 32
+#   or
+#   python hex_file_chopper.py adm1266_v1.14.3.hex "2 Board Demo-device@40.hex" --sizes 16 32 64 --output-dir chopped
+#   or
+#   for (cmd, data, line) in hex_file_chopper.chunk_records("adm1266_v1.14.3.hex", 35):
+#       ...
 
-system_config_data = ""
-sequence_config_data = ""
-logic_config_data = ""
-user_data = ""
-firmware_data = ""
-pdio_data = ""
+import sys
+import argparse
+import binascii
+import hashlib
+import json
+import os
+import shutil
+import atomic_file
+import hex_records
+from concurrent.futures import ProcessPoolExecutor
+
+# Commands whose block data is combined and written again in records of the new size
+Block_Commands = hex_records.Block_Commands
+
+# Commands whose data is cropped to the new size
+MFR_Commands = [0x99, 0x9A, 0x9B, 0x9C, 0x9D, 0x9E]
+
+PDIO_COMMAND = 0xD4
+# Data bytes of the PDIO configuration per record, 2 bytes for each of 8 PDIOs
+PDIO_DATA_SIZE = 16
 
 if sys.version_info.major < 3:
     input = raw_input
 
 
-def combine_large_data(file, size):
-    hex_file = open(file, "rb")   
-    commands = [0xD6, 0xD7, 0xE0, 0xE3, 0xFC, 0xD4]
-    count = 0
-
-    global system_config_data
-    global sequence_config_data
-    global logic_config_data
-    global user_data
-    global firmware_data
-    global pdio_data
-
-    for line in hex_file.readlines():      
-        cmd = int(line[3:7], 16)     
-        data_len = int(line[1:3], 16)       
-       
-        if (cmd in commands):
-            if (cmd == 0xD6):
-                if count!=0 :
-                    sequence_config_data += (line[15:15 + (data_len-3) * 2].decode("utf-8"))                                          
-                else:
-                    count = 1
-
-            elif (cmd == 0xD7):
-                system_config_data += (line[15:15 + (data_len-3) * 2].decode("utf-8"))                  
-
-            elif (cmd == 0xE0):
-                logic_config_data += (line[15:15 + (data_len-3) * 2].decode("utf-8"))                  
-
-            elif (cmd == 0xE3):
-                user_data += (line[15:15 + (data_len-3) * 2].decode("utf-8"))
-
-            elif (cmd == 0xFC):
-            	firmware_data += (line[15:15 + (data_len-3) * 2].decode("utf-8"))                  
-
-            elif (cmd == 0xD4):
-                pdio_data += (line[13:13 + (data_len-2) * 2].decode("utf-8"))         
-
-        if (line.startswith(b":00000001FF")):
-            break  
-
-    return 
-
-def data_print(data, size, cmd):    
-    acc_data_string = ""
-    data_size = size - 3
-    for x in range(0, len(data), data_size*2):
-        if ((len(data) - x) < (data_size*2)):
-            short_size = int((len(data) - x)/2 + 3)             
-            data_string = hex_string(data, short_size, cmd, x)            
-            crc = crc_calculation(data_string) 
-            acc_data_string += ":" + data_string + crc + "\r\n"
-
-        else:            
-            data_string = hex_string(data, size, cmd, x)
-            crc = crc_calculation(data_string) 
-            acc_data_string += ":" + data_string + crc + "\r\n"
-
-    return acc_data_string
-            
-    
-def hex_string(data_array, size, command, pointer):
-    data_size = size - 3
-    return ((hex(size).rstrip("L").lstrip("0x") or "0").upper().zfill(2) + "00" + (hex(command).rstrip("L").lstrip("0x") or "0").upper().zfill(2) + "00" + (hex(size-1).rstrip("L").lstrip("0x") or "0").upper().zfill(2) + offset_val(pointer) +  (data_array[pointer:pointer + data_size * 2]))
-
-def offset_val(offset):  
-    offset = int(offset / 2 )    
-    offset_string = '{:02X}'.format((offset & 0xFF)) + '{:02X}'.format((offset & 0xFF00) >> 8)
-    return offset_string
-
-def crc_calculation(data):    
-    data_array = array('B', codecs.decode(data, "hex")).tolist()
-    data_sum = sum(data_array)
-    crc = ((0xff - (data_sum & 0xFF)) + 1)
-    crc = crc & 0xFF   
-    return '{:02X}'.format(crc)
-
-def hex_chopper(file, size):    
-    data_size = size - 1
-    hex_file = open(file, "rb")
-    hex_file_new = open(file.rstrip(".hex") +"_" + str(size) + "_byte_block.hex", "w", newline=None, encoding="utf-8")
-
-    firmware_trigger = 0
-    system_config_trigger = 0
-    sequence_config_trigger = 0
-    logic_config_trigger = 0
-    user_data_trigger = 0   
-    ssp_data = False
-
-    for line in hex_file.readlines():            
-        if ssp_data == False:           
-            data_len = int(line[1:3], 16)
-            cmd = int(line[3:7], 16)
-            data = [] if data_len == 0 else array('B', codecs.decode((line[9:9 + data_len * 2]), "hex")).tolist()
-            
-            mfr_command = [0x99, 0x9A, 0x9B, 0x9C, 0x9D, 0x9E]
-            big_data_command = [0xFC, 0xD7, 0xE3, 0xE0, 0xD6, 0xD4]
-    
-            if ((cmd in mfr_command) and data_len > size):
-                # Start Code - Byte Count - Address - Record Type - Data - Checksum                        
-                data_string = (hex(size).rstrip("L").lstrip("0x") or "0").upper().zfill(2) + "00" + (hex(cmd).rstrip("L").lstrip("0x") or "0").upper().zfill(2) + "00" + (hex(data_size).rstrip("L").lstrip("0x") or "0").upper().zfill(2) + (line[11:11 + data_size * 2].decode("utf-8"))                        
-                hex_file_new.write(":" + data_string + crc_calculation(data_string) + "\r\n")
+# Returns the record line for the data of cmd: start code, byte count, the command code as address, record type 00, data
+# and checksum.
+def hex_record(cmd, data):
+    record = bytearray([len(data), 0x00, cmd, 0x00]) + data
+    record.append((-sum(record)) & 0xFF)
+    return b':' + binascii.hexlify(bytes(record)).upper() + b'\r\n'
+
+
+# Collects the data of the block records of one command and splits it into records of size bytes: byte count, offset
+# (2 bytes, little endian) and up to size - 3 data bytes, see hex_records.split_block. The offsets are the ones of the
+# records added, a record which does not follow on from the data before starts a new run at its own offset.
+class block_chunker:
+    def __init__(self, cmd, size):
+        self.cmd = cmd
+        self.data_size = size - 3
+        # offset of the first byte in data
+        self.offset = 0
+        self.data = bytearray()
+
+    def records(self, length):
+        records = [(self.cmd, fields, hex_record(self.cmd, bytearray(fields)))
+                   for fields in hex_records.split_block(self.offset, self.data[:length], self.data_size)]
+        del self.data[:length]
+        self.offset += length
+        return records
+
+    # Add the data of a block record at offset, returns the records which are full.
+    def add(self, offset, data):
+        records = []
+        if offset != self.offset + len(self.data):
+            records = self.flush()
+            self.offset = offset
+        self.data += data
+        # the data up to the last multiple of the record size is written
+        length = len(self.data) - (self.offset + len(self.data)) % self.data_size
+        if length > 0:
+            records += self.records(length)
+        return records
+
+    # Returns the record of the data which is left, if any.
+    def flush(self):
+        return self.records(len(self.data))
+
+
+# Yields (cmd, data, line) for every record of the chopped hex file up to the end of file record, the same as
+# hex_records.read_records does for the original file. size is the byte count of the new records, the number of data bytes + 3.
+# The records of a block command are combined and split again at their offsets, the 0xD6 record which erases the sequence
+# memory is kept. The records of the MFR_Commands are cropped to size bytes and the PDIO configuration is split into records
+# of 8 PDIOs.
+def chunk_records(file, size, verbose=False):
+    # chunker of the block records being read
+    current = None
+    for (cmd, data, line) in hex_records.read_records(file):
+        offset = hex_records.block_offset(cmd, data)
+        if current is not None and (cmd != current.cmd or offset is None):
+            for record in current.flush():
+                yield record
+            current = None
+
+        if cmd in Block_Commands and offset is None:
+            yield (cmd, data, line.rstrip(b'\r\n') + b'\r\n')
+
+        elif cmd in Block_Commands:
+            if current is None:
+                current = block_chunker(cmd, size)
+                current.offset = offset
+            for record in current.add(offset, data[3:]):
+                yield record
+
+        elif cmd in MFR_Commands and len(data) > size:
+            # Start Code - Byte Count - Address - Record Type - Data - Checksum
+            cropped = bytearray([size - 1]) + data[1:size]
+            if verbose:
                 print("Data cropped for command 0x{:02X}".format(cmd))
-                
-            elif (cmd in big_data_command):
-                if (cmd == 0xFC and firmware_trigger == 0):                  
-                    new_string = data_print(firmware_data, size, 0xFC)
-                    hex_file_new.write(new_string)      
-                    firmware_trigger = 1     
-                elif (cmd == 0xD7 and system_config_trigger == 0):
-                    new_string = data_print(system_config_data, size, 0xD7)
-                    hex_file_new.write(new_string)
-                    system_config_trigger = 1
-                elif (cmd == 0xE3 and user_data_trigger == 0):                
-                    new_string = data_print(user_data, size, 0xE3)
-                    hex_file_new.write(new_string)
-                    system_config_trigger = 1
-                elif (cmd == 0xE0 and logic_config_trigger == 0):
-                    new_string = data_print(logic_config_data, size, 0xE0)
-                    hex_file_new.write(new_string)
-                    logic_config_trigger = 1
-                elif (cmd == 0xD6 and sequence_config_trigger == 1):
-                    new_string = data_print(sequence_config_data, size, 0xD6)
-                    hex_file_new.write(new_string)
-                    sequence_config_trigger = 2
-                elif (cmd == 0xD6 and sequence_config_trigger == 0):
-                    hex_file_new.write(line[:-2].decode("ascii") + "\r\n") 
-                    sequence_config_trigger = 1
-                elif (cmd == 0xD4):
-                    data_string = "1200D4001100" + pdio_data[:32]
-                    hex_file_new.write(":" + data_string + crc_calculation(data_string) + "\r\n")                     
-                    data_string = "1200D4001108" + pdio_data[32:]
-                    hex_file_new.write(":" + data_string + crc_calculation(data_string) + "\r\n") 
-
-            else:
-                hex_file_new.write(line[:].decode("ascii"))  
-
-                if (line.startswith(b":00000001FF")):
-                    ssp_data = True 
-        else:
-            #hex_file_new.write(line[:-2].decode("ascii") + "\r\n")  
-            hex_file_new.write(line[:].decode("utf-8"))
-     
+            yield (cmd, bytes(cropped), hex_record(cmd, cropped))
 
-    hex_file_new.close()
+        elif cmd == PDIO_COMMAND:
+            pdio_data = bytearray(data[2:])
+            for x in range(0, len(pdio_data), PDIO_DATA_SIZE):
+                pdio = bytearray([len(pdio_data[x:x + PDIO_DATA_SIZE]) + 1, data[1] + x // 2]) + pdio_data[x:x + PDIO_DATA_SIZE]
+                yield (cmd, bytes(pdio), hex_record(cmd, pdio))
 
+        else:
+            yield (cmd, data, line)
+
+    if current is not None:
+        for record in current.flush():
+            yield record
+
+
+# Copy the end of file record and the project information after it to output.
+def copy_trailing(file, output):
+    with open(file, "rb") as hex_file:
+        for line in hex_file:
+            if line.startswith(hex_records.EOF_RECORD):
+                output.write(line)
+                shutil.copyfileobj(hex_file, output)
+                return
+
+
+def chopped_file_name(file, size, output_dir=None):
+    name = os.path.splitext(file)[0] + "_" + str(size) + "_byte_block.hex"
+    return name if output_dir is None else os.path.join(output_dir, os.path.basename(name))
+
+
+# Writes to a file and keeps the SHA-256 of everything written.
+class hashing_writer:
+    def __init__(self, output):
+        self.output = output
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        self.output.write(data)
+
+
+# Write the chopped hex file, one record at a time, see atomic_file. Returns (name of the new file, SHA-256 of the new file).
+def hex_chopper(file, size, output_file=None, verbose=True):
+    if output_file is None:
+        output_file = chopped_file_name(file, size)
+    with atomic_file.atomic_file(output_file, "wb") as hex_file_new:
+        output = hashing_writer(hex_file_new)
+        for (cmd, data, line) in chunk_records(file, size, verbose):
+            output.write(line)
+        copy_trailing(file, output)
+    return (output_file, output.hash.hexdigest())
+
+
+# Returns the message why the number of data bytes per record cannot be used, None if it can.
+def check_block_size(block_size):
+    if block_size % 4 != 0:
+        return "Byte Size needs to be multiple of 4."
+    if block_size < 16:
+        return "Number of bytes needs to be 16 or greater."
+    return None
+
+
+# Worker process of chop_batch, chops one file to one size. Returns its manifest entry.
+def chop_job(file, block_size, output_dir):
+    entry = {'input': file, 'block_size': block_size, 'output': None, 'sha256': None, 'input_sha256': None, 'error': None}
+    try:
+        entry['input_sha256'] = hex_records.Load_Hex(file).digest()
+        (entry['output'], entry['sha256']) = hex_chopper(file, block_size + 3,
+                                                         chopped_file_name(file, block_size + 3, output_dir), False)
+    except Exception as e:
+        entry['error'] = str(e)
+    return entry
+
+
+# Chop every file to every block size, the number of data bytes per record as on the command line, in a pool of
+# processes. The new files are written next to their input or to output_dir.
+# Returns the manifest entries in the order of files and block_sizes: input, block_size, output, sha256 of the output,
+# input_sha256 and error, None if the file was written.
+def chop_batch(files, block_sizes, processes=None, output_dir=None):
+    for block_size in block_sizes:
+        if check_block_size(block_size) is not None:
+            raise Exception('Block size {0}: {1}'.format(block_size, check_block_size(block_size)))
+    jobs = [(file, block_size) for file in files for block_size in block_sizes]
+    outputs = [os.path.abspath(chopped_file_name(file, block_size + 3, output_dir)) for (file, block_size) in jobs]
+    for output in outputs:
+        if outputs.count(output) > 1:
+            raise Exception('More than one input is written to ' + output)
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(chop_job, file, block_size, output_dir) for (file, block_size) in jobs]
+    return [future.result() for future in futures]
+
+
+# Write the manifest as JSON, see atomic_file. The output paths are relative to the manifest.
+def write_manifest(entries, file):
+    directory = os.path.dirname(os.path.abspath(file))
+    manifest = []
+    for entry in entries:
+        entry = dict(entry)
+        if entry['output'] is not None:
+            entry['output'] = os.path.relpath(os.path.abspath(entry['output']), directory).replace(os.sep, '/')
+        manifest.append(entry)
+    with atomic_file.atomic_file(file, 'w') as json_file:
+        json.dump(manifest, json_file, indent=2)
 
 
 if __name__ == '__main__':
 
-    if len(sys.argv) != 3:
-        print("hex_file_chopper [INPUT_FILE_NAME] [Number of bytes needs to be 16 or greater, and multiple of 4]")
-        exit(-1)
-
-    hex_file = sys.argv[1]
-    chunk_size = int(sys.argv[2]) + 3
-    multiple_4_check = int(sys.argv[2]) % 4 
-
-
-    if ((int(sys.argv[2]) > 15) & (multiple_4_check ==0)) :
-        combine_large_data(hex_file,chunk_size)
-        hex_chopper(hex_file, chunk_size)
-    else:
-        if (multiple_4_check != 0):
-            print("Byte Size needs to be multiple of 4.")
+    # hex_file_chopper [INPUT_FILE_NAME] [Number of bytes]
+    if len(sys.argv) == 3 and sys.argv[2].isdigit():
+        hex_file = sys.argv[1]
+        block_size = int(sys.argv[2])
+        if check_block_size(block_size) is not None:
+            print(check_block_size(block_size))
+            exit(-1)
+        hex_chopper(hex_file, block_size + 3)
+        exit(0)
+
+    parser = argparse.ArgumentParser(description='Split the block records of ADM1266 hex files into smaller records. '
+                                                 'hex_file_chopper [INPUT_FILE_NAME] [Number of bytes] chops one file.')
+    parser.add_argument('files', nargs='+', help='hex files to chop')
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, required=True,
+                        help='data bytes per record, 16 or greater and multiple of 4')
+    parser.add_argument('-o', '--output-dir', help='directory of the new files, next to the input files by default')
+    parser.add_argument('--processes', type=int, help='number of worker processes, one per CPU by default')
+    parser.add_argument('--manifest', help='JSON manifest of the new files and their SHA-256, chop_manifest.json in the '
+                                           'output directory by default')
+    args = parser.parse_args()
+    for block_size in args.sizes:
+        if check_block_size(block_size) is not None:
+            print('{0} bytes: {1}'.format(block_size, check_block_size(block_size)))
+            exit(-1)
+
+    entries = chop_batch(args.files, args.sizes, args.processes, args.output_dir)
+    for entry in entries:
+        if entry['error'] is None:
+            print('{0} {1}'.format(entry['sha256'], entry['output']))
         else:
-            print("Number of bytes needs to be 16 or greater.")
-
+            print('Failed {0} with {1} bytes: {2}'.format(entry['input'], entry['block_size'], entry['error']))
+    manifest = args.manifest
+    if manifest is None:
+        manifest = os.path.join(args.output_dir if args.output_dir is not None else '.', 'chop_manifest.json')
+    write_manifest(entries, manifest)
+    if any(entry['error'] is not None for entry in entries):
+        sys.exit(1)
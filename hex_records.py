@@ -0,0 +1,211 @@
+# Copyright (c) 2019-2021 Analog Devices Inc.
+# All rights reserved.
+# www.analog.com
+
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Intel HEX files of the ADM1266, shared by ADM1266_Lib, ADM1266_Plan, ADM1266_Sim and hex_file_chopper.
+# Load_Hex returns the Hex_File of a file, which is parsed once when it is first used and then cached until the file changes,
+# so a file used several times, e.g. decoded offline and then programmed, is only read once.
+# A Hex_File holds the records up to the end of file record (:00000001FF) indexed by PMBus command code, the offsets of the
+# block write records and the metadata which follows the end of file record in the configuration files, read only if used.
+# read_records reads the records one at a time without keeping them.
+# Every record line is decoded with a single unhexlify call, the 16 bit address field of a record is the PMBus command code.
+# Example:
+#   hex_file = hex_records.Load_Hex("2 Board Demo-device@40.hex")
+#   for (cmd, data, line) in hex_file.records_of(0xD7):
+#       ...
+#   hex_file.metadata()['Device Address']
+
+import binascii
+import hashlib
+import mmap
+import os
+import threading
+
+EOF_RECORD = b":00000001FF"
+
+# Commands whose records are block writes: byte count, offset (2 bytes, little endian), data
+Block_Commands = [0xFC, 0xD7, 0xE3, 0xE0, 0xD6]
+
+
+# Decode one record line, returns (cmd, record type, data) or None if the line is not a record.
+def parse_record(line, verify=False):
+    end = len(line)
+    while end > 0 and line[end - 1] in b'\r\n':
+        end -= 1
+    if end < 11 or line[0:1] != b':':
+        return None
+    record = binascii.unhexlify(memoryview(line)[1:end])
+    data_len = record[0]
+    if verify and (sum(bytearray(record)) & 0xFF) != 0:
+        raise Exception('Checksum error in hex record ' + bytes(line[:end]).decode('ascii'))
+    return ((record[1] << 8) | record[2], record[3], record[4:4 + data_len])
+
+
+def file_lines(file, use_mmap):
+    with open(file, "rb") as hex_file:
+        if not use_mmap:
+            for line in hex_file:
+                yield line
+            return
+        view = mmap.mmap(hex_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < len(view):
+                end = view.find(b'\n', start)
+                end = len(view) if end < 0 else end + 1
+                yield view[start:end]
+                start = end
+        finally:
+            view.close()
+
+
+# Yields (cmd, data, line) for every record of the hex file up to the end of file record, data is the bytes of the data field
+# and line the raw line with its line ending.
+# With verify set the checksum of every record is checked. use_mmap reads the file through a memory map instead of a buffered file.
+# The generator returns (end of file record line, position of the line after it), the line is None if the file has none.
+def read_records(file, verify=False, use_mmap=False):
+    position = 0
+    for line in file_lines(file, use_mmap):
+        position += len(line)
+        if line.startswith(EOF_RECORD):
+            return (bytes(line), position)
+        record = parse_record(line, verify)
+        if record is not None:
+            yield (record[0], record[2], line)
+    return (None, position)
+
+
+# Returns the offset of a block write record, None if it is not a block write at an offset, e.g. the 0xD6 record which erases
+# the sequence memory. data is the data field of the record.
+def block_offset(cmd, data):
+    data = bytearray(data)
+    if cmd not in Block_Commands or len(data) < 4 or data[0] != len(data) - 1:
+        return None
+    offset = data[1] | (data[2] << 8)
+    return None if offset == 0xFFFF else offset
+
+
+# Returns the data fields of the block write records for data at offset: byte count, offset (2 bytes, little endian) and up to
+# max_payload data bytes. A record never crosses a multiple of max_payload.
+def split_block(offset, data, max_payload):
+    fields = []
+    start = 0
+    while start < len(data):
+        end = min(len(data), start + max_payload - (offset + start) % max_payload)
+        address = offset + start
+        fields.append(bytes(bytearray([end - start + 2, address & 0xFF, address >> 8]) + data[start:end]))
+        start = end
+    return fields
+
+
+class Hex_File:
+    def __init__(self, file, stamp=None):
+        self.file = file
+        # (modification time, size) of the file when it was loaded
+        self.stamp = stamp
+        self.lock = threading.Lock()
+        # list of (cmd, data, line) up to the end of file record, None until parsed
+        self.record_list = None
+        # cmd -> indexes of its records in record_list
+        self.index = None
+        # end of file record line and the position of the line after it
+        self.eof_line = None
+        self.eof_position = None
+        self.trailing_data = None
+        self.sha256 = None
+
+    def parse(self):
+        with self.lock:
+            if self.record_list is not None:
+                return
+            records = []
+            index = {}
+            stream = read_records(self.file)
+            while True:
+                try:
+                    (cmd, data, line) = next(stream)
+                except StopIteration as end:
+                    (self.eof_line, self.eof_position) = end.value
+                    break
+                index.setdefault(cmd, []).append(len(records))
+                records.append((cmd, data, line))
+            self.index = index
+            self.record_list = records
+
+    # Returns the list of (cmd, data, line) of all the records up to the end of file record.
+    def records(self):
+        if self.record_list is None:
+            self.parse()
+        return self.record_list
+
+    def commands(self):
+        self.records()
+        return sorted(self.index)
+
+    def records_of(self, cmd):
+        records = self.records()
+        return [records[i] for i in self.index.get(cmd, [])]
+
+    # Returns (offset, data) of the block write records of cmd, data without byte count and offset.
+    def block_offsets(self, cmd):
+        blocks = []
+        for (record_cmd, data, line) in self.records_of(cmd):
+            offset = block_offset(cmd, data)
+            if offset is not None:
+                blocks.append((offset, data[3:]))
+        return blocks
+
+    # Returns the end of file record line, None if the file has none.
+    def eof(self):
+        self.records()
+        return self.eof_line
+
+    # Returns the bytes which follow the end of file record, e.g. the project information of a configuration file.
+    def trailing(self):
+        self.records()
+        if self.trailing_data is None:
+            with open(self.file, 'rb') as hex_file:
+                hex_file.seek(self.eof_position)
+                self.trailing_data = hex_file.read()
+        return self.trailing_data
+
+    # Returns the '@name:value' lines of the trailing section as a dict, e.g. {'Device': 'ADM1266', 'Device Address': '0x40'}.
+    def metadata(self):
+        metadata = {}
+        for line in self.trailing().splitlines():
+            if line.startswith(b'@') and b':' in line:
+                (name, value) = line[1:].split(b':', 1)
+                metadata[name.decode('utf-8', 'replace').strip()] = value.decode('utf-8', 'replace').strip()
+        return metadata
+
+    # SHA-256 of the whole file as a hex string.
+    def digest(self):
+        if self.sha256 is None:
+            hash = hashlib.sha256()
+            with open(self.file, 'rb') as hex_file:
+                for chunk in iter(lambda: hex_file.read(1 << 16), b''):
+                    hash.update(chunk)
+            self.sha256 = hash.hexdigest()
+        return self.sha256
+
+
+# absolute path of the file -> Hex_File
+Hex_Files = {}
+Hex_Files_Lock = threading.Lock()
+
+
+# Returns the Hex_File of the file, the same one as long as the file does not change.
+def Load_Hex(file):
+    path = os.path.abspath(file)
+    status = os.stat(path)
+    stamp = (status.st_mtime, status.st_size)
+    with Hex_Files_Lock:
+        hex_file = Hex_Files.get(path)
+        if hex_file is None or hex_file.stamp != stamp:
+            hex_file = Hex_File(path, stamp)
+            Hex_Files[path] = hex_file
+    return hex_file